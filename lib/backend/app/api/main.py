@@ -1,35 +1,331 @@
-from fastapi import FastAPI, UploadFile, File
-from pathlib import Path
-import shutil
+import asyncio
+import time
+from contextlib import asynccontextmanager
 
-from lib.backend.app.services.embedding_service import create_embedding
-from lib.backend.app.services.search_service import search_similar
-from lib.backend.app.config import INFERENCE_TMP_DIR
+import numpy as np
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from lib.backend.app.config import (
+    PREDICT_BATCH_MAX_FILES,
+    QUERY_FUSION,
+    QUERY_VIEW_MODE,
+    REQUEST_LOG,
+    RESULT_CACHE_PERCEPTUAL,
+    SEARCH_SHARDED,
+    TOP_K,
+    WARMUP_BATCH_SIZES,
+)
+from lib.backend.app.services.embedder import get_embedder
+from lib.backend.app.services.embedding_service import (
+    create_embedding_batched,
+    create_embeddings_checked,
+    create_view_embeddings,
+    embedding_batcher,
+)
+from lib.backend.app.services.search_service import (
+    active_index,
+    index_size,
+    search_filters,
+    search_index,
+    search_index_batch,
+)
+from lib.backend.app.services.query_views import check_mode, mode_key
+from lib.backend.app.services.vector_index import get_index, reload_index, start_watcher
+from lib.backend.app.services.sharding import close_sharded_index
+from lib.backend.app.services.executor import run_blocking, shutdown_executor
+from lib.backend.app.services.image_io import ImageDecodeError
+from lib.backend.app.services.result_cache import cache_keys, result_cache
+from lib.backend.app.services.metrics import (
+    Gauge,
+    REQUEST_SECONDS,
+    REQUESTS_TOTAL,
+    enable_request_log,
+    end_trace,
+    log_request,
+    register,
+    render_metrics,
+    start_trace,
+    timed,
+)
+
+# ==========================================
+# 起動・終了処理
+# ==========================================
+# 起動直後の1件目が重くならないよう、モデル・インデックスの読み込みと
+# ダミー推論をバックグラウンドで済ませ、終わったら /ready が 200 を返す。
+_readiness = {
+    "ready": False,
+    "error": None,
+    "stages_ms": {},
+}
+
+
+def warm_up():
+    """
+    インデックス・モデルを読み込み、設定したバッチサイズでダミー推論・検索を行う
+    """
+    stages = _readiness["stages_ms"]
+
+    # シャード分割時はワーカープロセスの起動（各シャードの読み込み）を待つ
+    start = time.perf_counter()
+    index = active_index()
+    if SEARCH_SHARDED:
+        index.start()
+    stages["index"] = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    get_embedder().warmup(WARMUP_BATCH_SIZES)
+    stages["model"] = (time.perf_counter() - start) * 1000.0
+
+    # 行列全体に一度触れておく（memmap のページ読み込み・BLAS の初期化）
+    start = time.perf_counter()
+    search_index(np.ones(index.dim, dtype=np.float32))
+    stages["search"] = (time.perf_counter() - start) * 1000.0
+
+
+async def _warm_up_in_background():
+    try:
+        await run_blocking(warm_up)
+    except Exception as e:
+        _readiness["error"] = f"{type(e).__name__}: {e}"
+        print(f"[ERROR] ウォームアップに失敗しました: {_readiness['error']}")
+        return
+
+    _readiness["ready"] = True
+    total = sum(_readiness["stages_ms"].values())
+    print(f"[OK] ウォームアップ完了（{total:.0f} ms）")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup_task = asyncio.create_task(_warm_up_in_background())
+    # インデックスはファイル更新だけを監視して差し替える（シャード分割時は再起動で反映する）
+    if not SEARCH_SHARDED:
+        start_watcher()
+
+    yield
+
+    _readiness["ready"] = False
+    warmup_task.cancel()
+    shutdown_executor()
+    close_sharded_index()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# バッチキュー・キャッシュの集計値も /metrics で公開する
+register(Gauge(
+    "conecone_batch_queue_depth", "Embedding micro-batch queue depth",
+    lambda: embedding_batcher.stats()["queue_depth"],
+))
+register(Gauge(
+    "conecone_cache_hits_total", "Result cache hits",
+    lambda: result_cache.hits, kind="counter",
+))
+register(Gauge(
+    "conecone_cache_misses_total", "Result cache misses",
+    lambda: result_cache.misses, kind="counter",
+))
+register(Gauge(
+    "conecone_index_size", "Number of vectors in the loaded index",
+    index_size,
+))
+
+if REQUEST_LOG:
+    enable_request_log()
+
+
+@app.middleware("http")
+async def measure_request(request: Request, call_next):
+    # リクエスト全体の時間と、処理段階ごとの時間（timed で計測）を記録する
+    stages, token = start_trace()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        duration = time.perf_counter() - start
+        end_trace(token)
+
+        # ラベルの種類が増えすぎないよう、URL ではなくルートのパスを使う
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.observe(duration, path)
+        REQUESTS_TOTAL.inc(path, str(status))
+
+        if REQUEST_LOG:
+            log_request(path, status, duration, stages)
+
+
+@app.get("/health")
+def health():
+    # プロセスが応答できるか（liveness）。重い処理は行わない
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready():
+    # ウォームアップが終わるまでは 503（readiness）
+    body = {
+        "ready": _readiness["ready"],
+        "error": _readiness["error"],
+        "stages_ms": _readiness["stages_ms"],
+    }
+    return JSONResponse(content=body, status_code=200 if _readiness["ready"] else 503)
+
+
+@app.post("/index/reload")
+def reload():
+    # シャード分割時は各ワーカーが起動時に開いたシャードを使い続けるため、再起動で反映する
+    if SEARCH_SHARDED:
+        raise HTTPException(
+            status_code=409,
+            detail="シャード分割時はインデックスを再読み込みできません（サーバーを再起動してください）",
+        )
+
+    reloaded = reload_index(force=True)
+    index = get_index()
+    return {
+        "reloaded": reloaded,
+        "version": index.version,
+        "count": len(index),
+    }
+
+
+@app.get("/stats")
+def stats():
+    # マイクロバッチのキュー長・バッチサイズ分布（レイテンシとスループットの調整用）
+    return {
+        "batching": embedding_batcher.stats(),
+        "cache": result_cache.stats(),
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus のテキスト形式
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
-app = FastAPI()
 
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    print("=== predict called ===")
-    print("filename:", file.filename)
-
-    # 1️⃣ 保存
-    #INFERENCE_TMP_DIR.mkdir(parents=True, exist_ok=True)
-    #save_path = INFERENCE_TMP_DIR / file.filename
-    tmp_dir = Path(INFERENCE_TMP_DIR)
-    save_path = tmp_dir / file.filename
-    
-    with save_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # 2️⃣ embedding 作成
-    query_embedding = create_embedding(str(save_path))
-    
-
-    # 3️⃣ 類似検索
-    results = search_similar(query_embedding)
-
-    # 4️⃣ 結果を返す
+async def predict(
+    file: UploadFile = File(...),
+    brand: str | None = None,
+    series: str | None = None,
+    year: str | None = None,
+    views: str = QUERY_VIEW_MODE,
+    fusion: str = QUERY_FUSION,
+):
+    # brand / series / year を指定すると一致する商品だけを検索する
+    filters = search_filters(brand, series, year)
+
+    # views を指定すると切り抜き・反転した複数ビューで検索し、スコアを fusion で統合する
+    # （ビュー数だけ推論のバッチが大きくなる）
+    try:
+        check_mode(views, fusion)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    mode = mode_key(views, fusion)
+
+    # 1️⃣ 読み込み（一時ファイルには保存せずメモリ上でデコードする）
+    with timed("upload_read"):
+        data = await file.read()
+
+    # 2️⃣ キャッシュ確認（同じ画像の再送なら推論・検索を省略する）
+    with timed("cache"):
+        if RESULT_CACHE_PERCEPTUAL:
+            keys = await run_blocking(cache_keys, data, TOP_K, filters, mode=mode)
+        else:
+            keys = cache_keys(data, TOP_K, filters, mode=mode)
+        version = active_index().version
+
+        results = result_cache.get(keys, version)
+    if results is not None:
+        return {
+            "results": results
+        }
+
+    # 3️⃣ embedding 作成（読み込めない画像は 400。結果はキャッシュしない）
+    try:
+        with timed("embed"):
+            if mode is None:
+                # マイクロバッチの待ち時間を含む
+                query_embedding = await create_embedding_batched(data)
+            else:
+                # 全ビューを1回の forward で embedding にする
+                view_embeddings = await run_blocking(create_view_embeddings, data, views)
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"画像を読み込めません: {e}")
+
+    if mode is None:
+        # 4️⃣ 類似検索
+        found = await run_blocking(search_index, query_embedding, TOP_K, filters)
+    else:
+        # 4️⃣ 類似検索（ビューごとのスコアを統合してから top-k）
+        found = await run_blocking(search_index, view_embeddings, TOP_K, filters, fusion)
+
+    # 一部のシャードが応答しなかった結果はキャッシュせず、partial を付けて返す
+    results = found["results"]
+    if found["partial"]:
+        return {
+            "results": results,
+            "partial": True,
+        }
+    result_cache.put(keys, version, results)
+
+    # 5️⃣ 結果を返す
     return {
         "results": results
     }
+
+
+@app.post("/predict/batch")
+async def predict_batch(
+    files: list[UploadFile] = File(...),
+    brand: str | None = None,
+    series: str | None = None,
+    year: str | None = None,
+):
+    filters = search_filters(brand, series, year)
+
+    if len(files) > PREDICT_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"画像は1回 {PREDICT_BATCH_MAX_FILES} 枚までです",
+        )
+
+    # 1️⃣ 読み込み
+    with timed("upload_read"):
+        datas = [await file.read() for file in files]
+
+    # 2️⃣ embedding 作成（全画像を1回の forward で処理する）
+    with timed("embed"):
+        embeddings, errors = await run_blocking(create_embeddings_checked, datas)
+
+    # 3️⃣ 類似検索（読み込めた画像だけを行列積1回で検索する）
+    ok_rows = [i for i, error in enumerate(errors) if error is None]
+    results = []
+    partial = False
+    if ok_rows:
+        found = await run_blocking(search_index_batch, embeddings[ok_rows], TOP_K, filters)
+        results, partial = found["results"], found["partial"]
+
+    # 4️⃣ 結果を返す（失敗した画像は errors に分けて返す）
+    # 一部のシャードが応答しなかった場合は partial を付ける
+    body = {
+        "results": [
+            {"index": row, "filename": files[row].filename, "results": row_results}
+            for row, row_results in zip(ok_rows, results)
+        ],
+        "errors": [
+            {"index": row, "filename": files[row].filename, "error": error}
+            for row, error in enumerate(errors)
+            if error is not None
+        ],
+    }
+    if partial:
+        body["partial"] = True
+    return body
@@ -1,10 +1,13 @@
-import os
-import uuid
-from fastapi import APIRouter, UploadFile, File
+from fastapi import APIRouter, UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse
 
-from app.services.image_search_service import ImageSearchService
-from app.config import TMP_DIR, TOP_K
+from lib.backend.app.services.image_search_service import ImageSearchService
+from lib.backend.app.services.search_service import search_filters
+from lib.backend.app.services.executor import run_blocking
+from lib.backend.app.services.image_io import ImageDecodeError
+from lib.backend.app.services.metrics import timed
+from lib.backend.app.services.query_views import check_mode
+from lib.backend.app.config import TOP_K, PREDICT_BATCH_MAX_FILES, QUERY_FUSION, QUERY_VIEW_MODE
 
 router = APIRouter(
     prefix="/predict",
@@ -16,14 +19,78 @@ search_service = ImageSearchService()
 
 
 @router.post("")
-async def predict(image: UploadFile = File(...)):
-    ext = os.path.splitext(image.filename)[1]
-    tmp_name = f"{uuid.uuid4()}{ext}"
-    tmp_path = os.path.join(TMP_DIR, tmp_name)
+async def predict(
+    image: UploadFile = File(...),
+    brand: str | None = None,
+    series: str | None = None,
+    year: str | None = None,
+    views: str = QUERY_VIEW_MODE,
+    fusion: str = QUERY_FUSION,
+):
+    # views（切り抜き・反転の組み合わせ）と fusion（スコアの統合方法）はリクエストごとに選べる
+    try:
+        check_mode(views, fusion)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    with open(tmp_path, "wb") as f:
-        f.write(await image.read())
+    # 一時ファイルには保存せずメモリ上でデコードする
+    with timed("upload_read"):
+        data = await image.read()
 
-    results = search_service.search(tmp_path, top_k=TOP_K)
+    # デコード・推論・検索はイベントループ外のスレッドプールで実行する
+    try:
+        found = await run_blocking(
+            search_service.search_with_status,
+            data,
+            top_k=TOP_K,
+            filters=search_filters(brand, series, year),
+            views=views,
+            fusion=fusion,
+        )
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"画像を読み込めません: {e}")
 
-    return JSONResponse(content={"results": results})
+    # 一部のシャードが応答しなかった場合は partial を付ける
+    content = {"results": found["results"]}
+    if found["partial"]:
+        content["partial"] = True
+    return JSONResponse(content=content)
+
+
+@router.post("/batch")
+async def predict_batch(
+    images: list[UploadFile] = File(...),
+    brand: str | None = None,
+    series: str | None = None,
+    year: str | None = None,
+):
+    if len(images) > PREDICT_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"画像は1回 {PREDICT_BATCH_MAX_FILES} 枚までです",
+        )
+
+    with timed("upload_read"):
+        datas = [await image.read() for image in images]
+
+    # 全画像を1回の推論・1回の行列積で処理する
+    items = await run_blocking(
+        search_service.search_batch, datas, top_k=TOP_K, filters=search_filters(brand, series, year)
+    )
+
+    content = {
+        "results": [
+            {"index": i, "filename": image.filename, "results": item["results"]}
+            for i, (image, item) in enumerate(zip(images, items))
+            if "results" in item
+        ],
+        "errors": [
+            {"index": i, "filename": image.filename, "error": item["error"]}
+            for i, (image, item) in enumerate(zip(images, items))
+            if "error" in item
+        ],
+    }
+    # 一部のシャードが応答しなかった場合は partial を付ける
+    if any(item.get("partial") for item in items):
+        content["partial"] = True
+    return JSONResponse(content=content)
@@ -11,14 +11,124 @@ BASE_DIR = os.path.dirname(_CURRENT_DIR)
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
 # embeddings.json のパス（←これを正とする）
+EMBEDDINGS_DIR = os.path.join(DATA_DIR, "embeddings")
 EMBEDDINGS_PATH = os.path.join(DATA_DIR, "embeddings", "embeddings.npy")
 IMAGE_IDS_PATH = os.path.join(DATA_DIR, "embeddings", "image_ids.json")
+MANIFEST_PATH = os.path.join(DATA_DIR, "embeddings", "manifest.json")
 PRODUCTS_JSON_PATH = os.path.join(DATA_DIR, "embeddings", "products.json")
 
+# 公開中の embedding の世代（scripts/extract_embeddings.py が更新する）
+# 存在する場合は上の3ファイルの代わりに embeddings/<世代>/ 内のファイルを使う
+# （app/services/embedding_store.py 参照）。残しておく世代数
+EMBEDDINGS_POINTER_PATH = os.path.join(DATA_DIR, "embeddings", "CURRENT")
+EMBEDDINGS_KEEP_GENERATIONS = 2
+
+# 列形式の商品カタログ（scripts/build_products_json.py で作成、embedding の行順）
+# 存在し行順が image_ids.json と一致すれば products.json の代わりに使う
+CATALOG_PATH = os.path.join(DATA_DIR, "embeddings", "catalog.npz")
+
+# インデックスファイル（scripts/build_index_file.py で作成）
+# 存在する場合は上の3ファイルの代わりにこちらを memmap で開く
+INDEX_FILE_PATH = os.path.join(DATA_DIR, "embeddings", "index.ccidx")
+
+# 近似最近傍（IVF）インデックス（scripts/build_ann_index.py で作成）
+IVF_INDEX_PATH = os.path.join(DATA_DIR, "embeddings", "ivf_index.npz")
+
+# 圧縮 embedding と PCA（scripts/compress_embeddings.py で作成。1ファイルにまとめて保存する）
+COMPRESSED_PATH = os.path.join(DATA_DIR, "embeddings", "compressed.npz")
+
 # 推論関連
 INFERENCE_TMP_DIR = os.path.join(DATA_DIR, "inference", "tmp")
 
+# 推論用スレッドプールのワーカー数
+INFERENCE_WORKERS = int(os.environ.get("CONECONE_INFERENCE_WORKERS", "2"))
+
+# PyTorch の intra-op スレッド数（0 なら PyTorch の既定値）
+# 1台で uvicorn ワーカーを複数動かす場合は「コア数 / ワーカー数」程度にする
+TORCH_NUM_THREADS = int(os.environ.get("CONECONE_TORCH_THREADS", "0"))
+
+# 推論バックエンド（"eager" / "torchscript" / "onnx" / "int8"）
+# eager 以外は起動時に eager の出力とのコサイン類似度を確認し、
+# INFERENCE_MIN_COSINE を下回る・作成に失敗する場合は eager に戻す
+INFERENCE_BACKEND = "eager"
+INFERENCE_MIN_COSINE = 0.99
+
+# 検証（int8 では校正も兼ねる）に使う画像と枚数
+INFERENCE_VALIDATION_DIR = os.path.join(DATA_DIR, "processed")
+INFERENCE_VALIDATION_IMAGES = 32
+
+# onnx バックエンド用のモデル（なければ初回に書き出す）
+ONNX_MODEL_PATH = os.path.join(DATA_DIR, "models", "resnet50.onnx")
+
+# マイクロバッチ推論（最大 BATCH_MAX_SIZE 件 or BATCH_MAX_WAIT_MS ミリ秒でまとめる）
+BATCH_MAX_SIZE = 8
+BATCH_MAX_WAIT_MS = 5.0
+
+# 起動時のダミー推論のバッチサイズ（カーネル選択などを本番前に済ませる）
+WARMUP_BATCH_SIZES = (1, BATCH_MAX_SIZE)
+
 # 検索設定
 TOP_K = 10
 
-print("config loaded:", EMBEDDINGS_PATH)
\ No newline at end of file
+# 検索結果キャッシュ（同じ画像の再送時に推論・検索を省略する）
+# 最大キー数（0 で無効）・有効期限（秒）・知覚ハッシュ（dHash）で近い画像も一致させるか
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 300.0
+RESULT_CACHE_PERCEPTUAL = False
+
+# 知覚ハッシュ（64ビット）が何ビット以内の差なら同じ画像とみなすか
+# RESULT_CACHE_PERCEPTUAL=True の場合、検索のたびに画像のデコード（イベントループ外）と、
+# キャッシュのロック内での近いキー探しが入る。近いキー探しはハッシュを
+# RESULT_CACHE_MAX_DISTANCE+1 個に分けた一部が一致するキーだけを比べるので、
+# 比較回数はキャッシュ全体ではなく候補数に比例する（距離を大きくするほど候補が増える）
+RESULT_CACHE_MAX_DISTANCE = 4
+
+# /predict/batch で1リクエストに受け付ける最大画像数
+PREDICT_BATCH_MAX_FILES = 32
+
+# 検索クエリの複数ビュー（切り抜き・左右反転）。/predict の views / fusion で上書きできる
+# "none" = 1枚のみ / "center" / "flip" / "crops" / "all"（app/services/query_views.py 参照）
+QUERY_VIEW_MODE = "none"
+# ビューごとのスコアの統合方法（"max" / "mean"）
+QUERY_FUSION = "max"
+# 四隅の切り抜きの一辺（元画像の短辺に対する割合）
+QUERY_CROP_FRACTION = 0.8
+
+# 検索方式（"exact" = 全件探索 / "ivf" = 近似最近傍 / "rerank" = 圧縮 embedding で候補を絞って再計算）
+# "ivf" / "rerank" で IVF_INDEX_PATH / COMPRESSED_PATH が無い・件数が合わない場合は全件探索になる
+SEARCH_BACKEND = "exact"
+
+# IVF で探索するリスト数（増やすほど再現率が上がり、遅くなる）
+IVF_NPROBE = 8
+
+# シャード分割したインデックス（scripts/build_index_file.py --shards N で作成）
+# SEARCH_SHARDED = True の場合、シャードごとのワーカープロセスに検索を振り分けて結果を統合する
+SHARDS_DIR = os.path.join(DATA_DIR, "embeddings", "shards")
+SEARCH_SHARDED = os.environ.get("CONECONE_SEARCH_SHARDED", "0") == "1"
+# シャードの応答を待つ時間（ミリ秒）。間に合わなかったシャードを除いた結果を partial として返す
+SHARD_TIMEOUT_MS = 500.0
+# ワーカープロセスの起動（インデックスの読み込み）を待つ時間（秒）
+SHARD_START_TIMEOUT = 60.0
+# 1シャードあたりの処理中・待ち行列の上限。超えたシャード（遅延中）には送らず partial にする
+# （時間切れで見捨てた検索がワーカーに溜まり、後続の検索まで遅れ続けるのを防ぐ）
+SHARD_MAX_PENDING = 4
+
+# "rerank" の候補数 = max(top_k × RERANK_EXPANSION, RERANK_MIN_CANDIDATES)
+# 候補だけを元の精度の行列（memmap）で計算し直すので、増やすほど再現率が上がり、遅くなる
+RERANK_EXPANSION = 30
+RERANK_MIN_CANDIDATES = 100
+
+# 圧縮設定：PCA の次元数・白色化の有無・PQ のサブ空間数（0 なら PQ なし）
+PCA_DIM = 256
+PCA_WHITEN = False
+PQ_SUBSPACES = 0
+
+# インデックスの保存形式（"float32" / "float16" / "int8"）
+# float16 / int8 はメモリを節約する代わりに類似度がわずかに丸められる
+INDEX_STORAGE_DTYPE = "float32"
+
+# インデックスの再読み込み監視間隔（秒）。0 以下で監視しない
+INDEX_WATCH_INTERVAL = 5.0
+
+# リクエストごとの処理時間を JSON 1行で出力するか（/metrics は常に有効）
+REQUEST_LOG = False
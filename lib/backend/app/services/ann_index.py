@@ -0,0 +1,199 @@
+import os
+import time
+import numpy as np
+
+from lib.backend.app.services.similarity import normalize_query, score, top_k
+
+# k-means の学習に使う1リストあたりのサンプル数
+TRAIN_SAMPLES_PER_LIST = 256
+
+# 割り当て計算を行う行数の単位
+ASSIGN_BLOCK_ROWS = 8192
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, spherical: bool = True) -> np.ndarray:
+    """
+    各行をもっとも近いセントロイドに割り当てる
+    spherical=True なら内積最大、False ならユークリッド距離最小
+    """
+    # ||x - c||^2 の最小化は x・c - ||c||^2 / 2 の最大化と同じ
+    bias = None if spherical else -0.5 * np.einsum("ij,ij->i", centroids, centroids)
+
+    labels = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], ASSIGN_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        sims = block @ centroids.T
+        if bias is not None:
+            sims += bias
+        labels[start:start + len(block)] = np.argmax(sims, axis=1)
+    return labels
+
+
+def kmeans(
+    sample: np.ndarray,
+    k: int,
+    n_iter: int = 20,
+    seed: int = 0,
+    spherical: bool = True,
+) -> np.ndarray:
+    """
+    k-means でセントロイド (k, D) を学習する
+    spherical=True は正規化済みベクトル向けの球面 k-means（コサイン類似度）
+    """
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(sample, dtype=np.float32)
+    n = sample.shape[0]
+
+    centroids = sample[rng.choice(n, k, replace=n < k)].copy()
+
+    for _ in range(n_iter):
+        labels = _assign(sample, centroids, spherical)
+
+        # クラスタごとの合計（ラベル順に並べて reduceat でまとめて足す）
+        order = np.argsort(labels, kind="stable")
+        present, starts = np.unique(labels[order], return_index=True)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+        counts = np.bincount(labels, minlength=k)
+
+        # 空になったクラスタはランダムなサンプルで置き直す
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(n, int(empty.sum()))]
+            counts[empty] = 1
+
+        if spherical:
+            centroids = normalize_query(sums)
+        else:
+            centroids = sums / counts[:, None]
+
+    return centroids
+
+
+def train_centroids(
+    matrix: np.ndarray,
+    n_lists: int,
+    n_iter: int = 20,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    正規化済みベクトルに対する球面 k-means（コサイン類似度）でセントロイドを学習する
+    """
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+
+    sample_size = min(n, n_lists * TRAIN_SAMPLES_PER_LIST)
+    sample = matrix[np.sort(rng.choice(n, sample_size, replace=False))]
+
+    return kmeans(sample, n_lists, n_iter=n_iter, seed=seed)
+
+
+class IVFIndex:
+    """
+    転置ファイル（IVF）方式の近似最近傍インデックス
+
+    ベクトル本体は VectorIndex の行列を使い、ここではセントロイドと
+    「リストごとの行番号」（CSR 形式）だけを持つ。
+    nprobe を増やすほど再現率が上がり、探索コストも増える。
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, rows: np.ndarray, nprobe: int = 8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.offsets = offsets
+        self.rows = rows
+        self.nprobe = nprobe
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, n_lists: int, n_iter: int = 20, seed: int = 0) -> "IVFIndex":
+        n_lists = max(1, min(n_lists, matrix.shape[0]))
+        centroids = train_centroids(matrix, n_lists, n_iter=n_iter, seed=seed)
+
+        labels = _assign(matrix, centroids)
+        rows = np.argsort(labels, kind="stable").astype(np.int64)
+        counts = np.bincount(labels, minlength=n_lists)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        return cls(centroids, offsets, rows)
+
+    def save(self, path: str):
+        # 監視スレッドが書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, centroids=self.centroids, offsets=self.offsets, rows=self.rows)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, nprobe: int = 8) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["offsets"], data["rows"], nprobe=nprobe)
+
+    # -------------------------
+    def candidates(self, query: np.ndarray, nprobe: int | None = None) -> np.ndarray:
+        """
+        クエリに近い nprobe 個のリストに含まれる行番号を返す
+        """
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        lists, _ = top_k(self.centroids @ query, nprobe)
+        return np.concatenate([
+            self.rows[self.offsets[i]:self.offsets[i + 1]] for i in lists
+        ])
+
+    def search(
+        self,
+        matrix: np.ndarray,
+        query: np.ndarray,
+        k: int,
+        scales: np.ndarray | None = None,
+        nprobe: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        正規化済みクエリに対する近似 top-k（行番号, スコア）を返す
+        """
+        cand = self.candidates(query, nprobe)
+        cand_scales = scales[cand] if scales is not None else None
+        scores = score(matrix[cand], query, cand_scales)
+        indices, top_scores = top_k(scores, k)
+        return cand[indices], top_scores
+
+
+def recall_at_k(
+    matrix: np.ndarray,
+    ann: IVFIndex,
+    queries: np.ndarray,
+    k: int = 10,
+    nprobe: int | None = None,
+    scales: np.ndarray | None = None,
+) -> dict:
+    """
+    全件探索の結果を正解として、IVF の recall@k と平均レイテンシを測る
+    """
+    queries = normalize_query(queries)
+
+    hits = 0
+    exact_time = 0.0
+    ann_time = 0.0
+    for query in queries:
+        t0 = time.perf_counter()
+        exact, _ = top_k(score(matrix, query, scales), k)
+        t1 = time.perf_counter()
+        approx, _ = ann.search(matrix, query, k, scales=scales, nprobe=nprobe)
+        t2 = time.perf_counter()
+
+        hits += len(np.intersect1d(exact, approx))
+        exact_time += t1 - t0
+        ann_time += t2 - t1
+
+    n = len(queries)
+    return {
+        "k": k,
+        "nprobe": nprobe or ann.nprobe,
+        "recall": hits / (n * min(k, matrix.shape[0])),
+        "exact_ms": exact_time / n * 1000.0,
+        "ann_ms": ann_time / n * 1000.0,
+    }
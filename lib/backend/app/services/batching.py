@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+from collections import Counter
+from typing import Any, Callable, Sequence
+
+from lib.backend.app.services.metrics import add_stages, current_trace, end_trace, start_trace
+
+
+class MicroBatcher:
+    """
+    非同期リクエストをまとめて1回のバッチ処理に流すキュー
+
+    最初の要素が届いてから max_wait_ms 経過するか、max_batch_size 件
+    集まった時点で batch_fn をまとめて呼び出し、各呼び出し元には
+    自分の結果だけを返す。batch_fn は入力と同じ順序・件数で結果を返すこと。
+    結果が例外オブジェクトの要素は、その呼び出し元にだけ例外として送出する。
+
+    batch_fn 内の timed() の計測はバッチ単位で集め、同じバッチに入った
+    各リクエストの記録（start_trace）に加える（バッチ全体の時間が入る）。
+
+    get_executor はバッチごとに呼んで実行先のプールを取る（None なら既定のプール）。
+    プールが終了・再作成されても（lifespan の再起動など）古いプールを使い続けない。
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[list], Sequence[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        get_executor: Callable[[], Any] | None = None,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.get_executor = get_executor
+
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+        # メトリクス
+        self.batches_total = 0
+        self.items_total = 0
+        self.max_queue_depth = 0
+        self.batch_sizes = Counter()
+
+    # -------------------------
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item) -> Any:
+        """
+        1件を投入し、バッチ処理後の結果を待つ
+        """
+        self._ensure_worker()
+
+        future = self._loop.create_future()
+        self._queue.put_nowait((item, future, current_trace()))
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+        return await future
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self._collect()
+            items = [item for item, _, _ in batch]
+
+            self.batches_total += 1
+            self.items_total += len(batch)
+            self.batch_sizes[len(batch)] += 1
+
+            try:
+                executor = self.get_executor() if self.get_executor is not None else None
+                # ワーカーのタスクは最初の呼び出し元のコンテキストを引き継いでいるので、
+                # 空のコンテキストで実行してバッチ専用の記録を取る
+                results, stages = await loop.run_in_executor(
+                    executor, contextvars.Context().run, self._run_batch, items
+                )
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, trace), result in zip(batch, results):
+                add_stages(trace, stages)
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _run_batch(self, items: list) -> tuple[Sequence[Any], dict]:
+        stages, token = start_trace()
+        try:
+            return self.batch_fn(items), stages
+        finally:
+            end_trace(token)
+
+    # -------------------------
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "batches_total": self.batches_total,
+            "items_total": self.items_total,
+            "mean_batch_size": (
+                self.items_total / self.batches_total if self.batches_total else 0.0
+            ),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
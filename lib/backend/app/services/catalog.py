@@ -0,0 +1,226 @@
+import os
+import numpy as np
+
+# ==========================================
+# 列形式の商品カタログ
+# ==========================================
+# 商品情報を embedding の行順に並べ、文字列は列ごとの表に1回だけ持つ
+# （行ごとには int32 の番号だけを持つ）。products.json を dict のリストとして
+# 全プロセスで保持するより、読み込みが速くメモリも小さい。
+
+COLUMNS = ("brand", "series", "model", "year")
+
+# 検索時の絞り込みに使える列
+FILTER_COLUMNS = ("brand", "series", "year")
+
+# 列の値がない行の番号
+MISSING = -1
+
+
+class _Interner:
+    """
+    文字列 → 連番 の表（同じ文字列は同じ番号になる）
+    """
+
+    def __init__(self):
+        self.values: list[str] = []
+        self.codes: dict[str, int] = {}
+
+    def code(self, value) -> int:
+        value = "" if value is None else str(value)
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _build_postings(codes: np.ndarray, n_values: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    値の番号ごとの行番号リスト（rows[offsets[c]:offsets[c+1]] が番号 c の行）
+    """
+    present = codes != MISSING
+    rows = np.flatnonzero(present)
+    rows = rows[np.argsort(codes[present], kind="stable")]
+    counts = np.bincount(codes[present], minlength=n_values)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return rows.astype(np.int64), offsets
+
+
+class CatalogBuilder:
+    """
+    商品を1件ずつ受け取り（CSV を流し読みしながら使う）、最後に行順を決めて Catalog を作る
+    """
+
+    def __init__(self):
+        self.tables = {column: _Interner() for column in COLUMNS}
+        self.records: dict[str, tuple] = {}
+
+    def add(self, image_id: str, product: dict) -> bool:
+        """
+        画像名に対応する商品を登録する。同じ画像名が既にあれば False（先頭を優先）
+        """
+        if image_id in self.records:
+            return False
+
+        # 商品 ID は数値とは限らないので文字列で持つ（ID が無い商品も商品として扱う）
+        product_id = product.get("id")
+        self.records[image_id] = ("" if product_id is None else str(product_id),) + tuple(
+            self.tables[column].code(product.get(column)) for column in COLUMNS
+        )
+        return True
+
+    def build(self, image_ids: list[str]) -> "Catalog":
+        """
+        image_ids（embedding の行順）に並べた Catalog を作る
+        """
+        n = len(image_ids)
+        present = np.zeros(n, dtype=bool)
+        product_ids = [""] * n
+        codes = {column: np.full(n, MISSING, dtype=np.int32) for column in COLUMNS}
+
+        for row, image_id in enumerate(image_ids):
+            record = self.records.get(image_id)
+            if record is None:
+                continue
+            present[row] = True
+            product_ids[row] = record[0]
+            for column, code in zip(COLUMNS, record[1:]):
+                codes[column][row] = code
+
+        tables = {column: np.array(self.tables[column].values, dtype=str) for column in COLUMNS}
+        return Catalog(
+            np.array(image_ids, dtype="S"), np.array(product_ids, dtype=str), present, codes, tables
+        )
+
+
+class Catalog:
+    """
+    embedding の行順に並んだ商品情報（読み取り専用）
+    """
+
+    def __init__(
+        self,
+        image_ids: np.ndarray,
+        product_ids: np.ndarray,
+        present: np.ndarray,
+        codes: dict[str, np.ndarray],
+        tables: dict[str, np.ndarray],
+    ):
+        self.image_ids = image_ids          # 固定長バイト列 (N,)
+        self.product_ids = product_ids      # 文字列 (N,)、商品 ID（無ければ ""）
+        self.present = present              # bool (N,)、商品情報がある行か
+        self.codes = codes                  # 列名 → int32 (N,)
+        self.tables = tables                # 列名 → 文字列の表
+
+        # 絞り込み用の転置リスト（列ごとに 値 → 行番号 を CSR 形式で持つ）
+        self._lookup = {}
+        self._postings = {}
+        for column in FILTER_COLUMNS:
+            self._lookup[column] = {str(v): code for code, v in enumerate(tables[column])}
+            self._postings[column] = _build_postings(codes[column], len(tables[column]))
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    @classmethod
+    def from_row_products(cls, image_ids: list[str], row_products: list[dict | None]) -> "Catalog":
+        builder = CatalogBuilder()
+        for image_id, product in zip(image_ids, row_products):
+            if product is not None:
+                builder.add(image_id, product)
+        return builder.build(image_ids)
+
+    # -------------------------
+    def matches(self, image_ids: list[str]) -> bool:
+        """
+        image_ids と同じ行順で作られたカタログか
+        """
+        return len(self.image_ids) == len(image_ids) and bool(
+            (self.image_ids == np.array(image_ids, dtype="S")).all()
+        )
+
+    def missing_rows(self) -> np.ndarray:
+        return np.flatnonzero(~self.present)
+
+    def value(self, column: str, row: int) -> str | None:
+        code = self.codes[column][row]
+        return None if code == MISSING else str(self.tables[column][code])
+
+    def product(self, row: int) -> dict | None:
+        if not self.present[row]:
+            return None
+
+        product = {"id": str(self.product_ids[row]) or None}
+        for column in COLUMNS:
+            product[column] = self.value(column, row)
+        product["image"] = self.image_ids[row].decode()
+        return product
+
+    def label(self, row: int) -> tuple[str, str]:
+        """
+        検索結果に表示する (ブランド, series + model)
+        """
+        if not self.present[row]:
+            return "Unknown", "Unknown"
+
+        brand = self.value("brand", row)
+        name = f"{self.value('series', row)} {self.value('model', row)}".strip()
+        return brand, name
+
+    def rows_for(self, column: str, value: str) -> np.ndarray:
+        """
+        column == value の行番号（昇順）。計算量は該当件数にだけ比例する
+        """
+        if column not in self._postings:
+            raise ValueError(f"絞り込みに使えない項目です: {column}")
+
+        code = self._lookup[column].get(value)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+
+        rows, offsets = self._postings[column]
+        return rows[offsets[code]:offsets[code + 1]]
+
+    def filter_rows(self, filters: dict[str, str]) -> np.ndarray:
+        """
+        すべての条件に一致する行番号（昇順）を返す
+        """
+        result = None
+        # 件数の少ない条件から順に積集合を取る
+        candidates = sorted(
+            (self.rows_for(column, value) for column, value in filters.items()),
+            key=len,
+        )
+        for rows in candidates:
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if len(result) == 0:
+                break
+        return result
+
+    # -------------------------
+    def save(self, path: str):
+        arrays = {
+            "image_ids": self.image_ids,
+            "product_ids": self.product_ids,
+            "present": self.present,
+        }
+        for column in COLUMNS:
+            arrays[f"{column}_codes"] = self.codes[column]
+            arrays[f"{column}_values"] = self.tables[column]
+
+        # 一時ファイルに書いてから置き換える（np.savez は拡張子 .npz を付けない場合に付け足す）
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Catalog":
+        with np.load(path) as data:
+            return cls(
+                data["image_ids"],
+                data["product_ids"],
+                data["present"],
+                {column: data[f"{column}_codes"] for column in COLUMNS},
+                {column: data[f"{column}_values"] for column in COLUMNS},
+            )
@@ -0,0 +1,373 @@
+import os
+import time
+import numpy as np
+
+from lib.backend.app.services.ann_index import kmeans
+from lib.backend.app.services.similarity import normalize_query, score, top_k
+
+# PCA / PQ の学習に使う最大サンプル数
+MAX_TRAIN_SAMPLES = 65536
+
+# PQ の1サブ空間あたりのセントロイド数（コードは uint8 に収まる）
+PQ_CENTROIDS = 256
+
+
+def _sample_rows(matrix: np.ndarray, n: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if matrix.shape[0] <= n:
+        return np.asarray(matrix, dtype=np.float32)
+    rows = np.sort(rng.choice(matrix.shape[0], n, replace=False))
+    return np.asarray(matrix[rows], dtype=np.float32)
+
+
+class PCA:
+    """
+    正規化済み embedding を低次元に射影する PCA（任意で白色化）
+
+    白色化しない場合は平均からの差分を射影する。元の内積は
+    x・q = (x-μ)・(q-μ) + μ・x + μ・q - μ・μ なので、射影同士の内積に
+    行ごとの μ・x（bias）を足せば元のコサイン類似度の近似になる。
+    白色化する場合は射影後に L2 正規化し、その空間のコサイン類似度を使う。
+    """
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, variances: np.ndarray, whiten: bool = False):
+        self.mean = mean.astype(np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.variances = variances.astype(np.float32)
+        self.whiten = whiten
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, matrix: np.ndarray, dim: int, whiten: bool = False, seed: int = 0) -> "PCA":
+        sample = _sample_rows(matrix, MAX_TRAIN_SAMPLES, seed)
+        mean = sample.mean(axis=0)
+        centered = sample - mean
+
+        # D x D の共分散行列を固有値分解し、分散の大きい順に dim 本取る
+        cov = centered.T @ centered / max(1, len(centered) - 1)
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        order = np.argsort(eigvals)[::-1][:dim]
+
+        return cls(mean, eigvecs[:, order].T, np.maximum(eigvals[order], 1e-12), whiten)
+
+    def transform(self, x: np.ndarray) -> np.ndarray:
+        projected = (np.asarray(x, dtype=np.float32) - self.mean) @ self.components.T
+        if self.whiten:
+            return normalize_query(projected / np.sqrt(self.variances))
+        return projected
+
+    def bias(self, x: np.ndarray) -> np.ndarray:
+        """
+        元の内積を復元するための μ・x（白色化時は使わない）
+        """
+        return np.asarray(x, dtype=np.float32) @ self.mean
+
+    def explained_variance_ratio(self, total_variance: float) -> float:
+        return float(self.variances.sum() / total_variance)
+
+    def arrays(self) -> dict:
+        """
+        CompressedStore のファイルに一緒に保存する配列
+        """
+        return {
+            "pca_mean": self.mean,
+            "pca_components": self.components,
+            "pca_variances": self.variances,
+            "pca_whiten": np.array(self.whiten),
+        }
+
+    @classmethod
+    def from_arrays(cls, data) -> "PCA":
+        return cls(data["pca_mean"], data["pca_components"], data["pca_variances"], bool(data["pca_whiten"]))
+
+
+class ProductQuantizer:
+    """
+    直積量子化（PQ）
+
+    ベクトルを m 個のサブ空間に分け、それぞれを 256 個のセントロイドの番号
+    （uint8）で表す。1ベクトルあたり m バイトになる。
+    検索はクエリ側を量子化しない非対称距離計算（ADC）で行う。
+    """
+
+    def __init__(self, codebooks: np.ndarray):
+        # codebooks: (m, 256, D/m)
+        self.codebooks = np.ascontiguousarray(codebooks, dtype=np.float32)
+
+    @property
+    def m(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def sub_dim(self) -> int:
+        return self.codebooks.shape[2]
+
+    @classmethod
+    def fit(cls, matrix: np.ndarray, m: int, n_iter: int = 15, seed: int = 0) -> "ProductQuantizer":
+        sample = _sample_rows(matrix, MAX_TRAIN_SAMPLES, seed)
+        if sample.shape[1] % m != 0:
+            raise ValueError(f"次元数 {sample.shape[1]} は m={m} で割り切れません")
+
+        sub_dim = sample.shape[1] // m
+        codebooks = np.stack([
+            kmeans(
+                sample[:, j * sub_dim:(j + 1) * sub_dim],
+                PQ_CENTROIDS,
+                n_iter=n_iter,
+                seed=seed + j,
+                spherical=False,
+            )
+            for j in range(m)
+        ])
+        return cls(codebooks)
+
+    def encode(self, x: np.ndarray, block_rows: int = 8192) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        codes = np.empty((x.shape[0], self.m), dtype=np.uint8)
+        sq_norms = np.einsum("mkd,mkd->mk", self.codebooks, self.codebooks)
+
+        for start in range(0, x.shape[0], block_rows):
+            block = x[start:start + block_rows]
+            for j in range(self.m):
+                sub = block[:, j * self.sub_dim:(j + 1) * self.sub_dim]
+                # 距離最小 = 内積 - ||c||^2/2 が最大
+                sims = sub @ self.codebooks[j].T - 0.5 * sq_norms[j]
+                codes[start:start + len(block), j] = np.argmax(sims, axis=1)
+
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.concatenate(
+            [self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1
+        )
+
+    def adc_scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        クエリ（量子化しない）と各コードの近似内積を返す
+        """
+        q = np.asarray(query, dtype=np.float32).reshape(self.m, self.sub_dim)
+        # サブ空間ごとの内積テーブル (m, 256)
+        table = np.einsum("mkd,md->mk", self.codebooks, q)
+
+        scores = np.zeros(codes.shape[0], dtype=np.float32)
+        for j in range(self.m):
+            scores += table[j][codes[:, j]]
+        return scores
+
+    def save(self, path: str):
+        np.savez(path, codebooks=self.codebooks)
+
+    @classmethod
+    def load(cls, path: str) -> "ProductQuantizer":
+        with np.load(path) as data:
+            return cls(data["codebooks"])
+
+
+class CompressedStore:
+    """
+    PCA（+ 任意で PQ）で圧縮した embedding と、その検索処理
+    """
+
+    def __init__(self, pca: PCA, vectors: np.ndarray | None = None,
+                 pq: ProductQuantizer | None = None, codes: np.ndarray | None = None,
+                 bias: np.ndarray | None = None):
+        self.pca = pca
+        self.vectors = vectors
+        self.pq = pq
+        self.codes = codes
+        self.bias = bias
+
+        # 射影後の次元と保存済みベクトル（PQ ならサブ空間の合計）の次元が合わないと検索できない
+        width = pq.m * pq.sub_dim if pq is not None else vectors.shape[1]
+        if width != pca.dim:
+            raise ValueError(f"PCA の次元 {pca.dim} と圧縮 embedding の次元 {width} が一致しません")
+
+    def __len__(self) -> int:
+        return len(self.codes) if self.codes is not None else len(self.vectors)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, dim: int, whiten: bool = False,
+              pq_subspaces: int = 0) -> "CompressedStore":
+        pca = PCA.fit(matrix, dim, whiten=whiten)
+        reduced = pca.transform(matrix)
+        bias = None if whiten else pca.bias(matrix)
+
+        if pq_subspaces:
+            pq = ProductQuantizer.fit(reduced, pq_subspaces)
+            return cls(pca, pq=pq, codes=pq.encode(reduced), bias=bias)
+
+        return cls(pca, vectors=reduced.astype(np.float32), bias=bias)
+
+    @property
+    def bytes_per_vector(self) -> int:
+        extra = 4 if self.bias is not None else 0
+        if self.codes is not None:
+            return self.codes.shape[1] + extra
+        return self.vectors.shape[1] * self.vectors.itemsize + extra
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """
+        元の次元の（正規化済み）クエリに対する近似スコアを返す
+        """
+        q = self.pca.transform(query)
+        if self.codes is not None:
+            scores = self.pq.adc_scores(self.codes, q)
+        else:
+            scores = score(self.vectors, q)
+
+        if self.bias is not None:
+            # 元の空間のコサイン類似度に揃える（定数項はクエリごとに共通）
+            mean = self.pca.mean
+            scores += self.bias + (float(query @ mean) - float(mean @ mean))
+        return scores
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        return top_k(self.scores(query), k)
+
+    def save(self, path: str):
+        # PCA と圧縮 embedding は組でしか使えないため1ファイルにまとめ、
+        # 一時ファイルに書いてから置き換える（読み込み側が片方だけ新しい組を見ないように）
+        arrays = self.pca.arrays()
+        if self.bias is not None:
+            arrays["bias"] = self.bias
+        if self.codes is not None:
+            arrays.update(codes=self.codes, codebooks=self.pq.codebooks)
+        else:
+            arrays["vectors"] = self.vectors
+
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CompressedStore":
+        with np.load(path) as data:
+            pca = PCA.from_arrays(data)
+            bias = data["bias"] if "bias" in data else None
+            if "codes" in data:
+                return cls(pca, pq=ProductQuantizer(data["codebooks"]), codes=data["codes"], bias=bias)
+            return cls(pca, vectors=data["vectors"], bias=bias)
+
+
+class RerankIndex:
+    """
+    2段階検索：圧縮ストアの近似スコアで候補を絞り、候補だけを
+    保存用行列（元の次元・精度）で計算し直して top-k を決める
+
+    IVFIndex と同じ search(matrix, query, k, scales) の形で VectorIndex から使う。
+    """
+
+    def __init__(self, store: CompressedStore, expansion: int = 30, min_candidates: int = 100):
+        self.store = store
+        self.expansion = expansion
+        self.min_candidates = min_candidates
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def shortlist_size(self, k: int, expansion: int | None = None) -> int:
+        expansion = expansion or self.expansion
+        return min(len(self), max(k * expansion, self.min_candidates))
+
+    def candidates(self, query: np.ndarray, k: int, expansion: int | None = None) -> np.ndarray:
+        """
+        近似スコア上位の行番号（1段目）
+        """
+        rows, _ = top_k(self.store.scores(query), self.shortlist_size(k, expansion))
+        return rows
+
+    def search(
+        self,
+        matrix: np.ndarray,
+        query: np.ndarray,
+        k: int,
+        scales: np.ndarray | None = None,
+        expansion: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        正規化済みクエリに対する top-k（行番号, 正確なスコア）を返す
+        """
+        cand = np.sort(self.candidates(query, k, expansion))
+        cand_scales = scales[cand] if scales is not None else None
+        scores = score(matrix[cand], query, cand_scales)
+        indices, top_scores = top_k(scores, k)
+        return cand[indices], top_scores
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "RerankIndex":
+        return cls(CompressedStore.load(path), **kwargs)
+
+
+def rerank_recall(
+    matrix: np.ndarray,
+    reranker: RerankIndex,
+    queries: np.ndarray,
+    k: int = 10,
+    expansion: int | None = None,
+    scales: np.ndarray | None = None,
+) -> dict:
+    """
+    全件探索の結果を正解として、2段階検索の recall@k と平均レイテンシを測る
+    """
+    queries = normalize_query(queries)
+
+    hits = 0
+    exact_time = 0.0
+    rerank_time = 0.0
+    for query in queries:
+        t0 = time.perf_counter()
+        exact, _ = top_k(score(matrix, query, scales), k)
+        t1 = time.perf_counter()
+        approx, _ = reranker.search(matrix, query, k, scales=scales, expansion=expansion)
+        t2 = time.perf_counter()
+
+        hits += len(np.intersect1d(exact, approx))
+        exact_time += t1 - t0
+        rerank_time += t2 - t1
+
+    n = len(queries)
+    return {
+        "k": k,
+        "expansion": expansion or reranker.expansion,
+        "candidates": reranker.shortlist_size(k, expansion),
+        "recall": hits / (n * min(k, matrix.shape[0])),
+        "exact_ms": exact_time / n * 1000.0,
+        "rerank_ms": rerank_time / n * 1000.0,
+    }
+
+
+def accuracy_report(matrix: np.ndarray, store: CompressedStore, queries: np.ndarray, k: int = 10) -> dict:
+    """
+    非圧縮の全件探索を正解として、圧縮ストアの recall@k・top-1 一致率・1件あたりのバイト数・速度を測る
+    """
+    queries = normalize_query(queries)
+
+    hits = 0
+    top1 = 0
+    exact_time = 0.0
+    compressed_time = 0.0
+    for query in queries:
+        t0 = time.perf_counter()
+        exact, _ = top_k(score(matrix, query), k)
+        t1 = time.perf_counter()
+        approx, _ = store.search(query, k)
+        t2 = time.perf_counter()
+
+        hits += len(np.intersect1d(exact, approx))
+        top1 += int(exact[0] == approx[0])
+        exact_time += t1 - t0
+        compressed_time += t2 - t1
+
+    n = len(queries)
+    return {
+        "k": k,
+        "recall": hits / (n * min(k, matrix.shape[0])),
+        "top1_agreement": top1 / n,
+        "bytes_per_vector": store.bytes_per_vector,
+        "original_bytes_per_vector": matrix.shape[1] * 4,
+        "exact_ms": exact_time / n * 1000.0,
+        "compressed_ms": compressed_time / n * 1000.0,
+    }
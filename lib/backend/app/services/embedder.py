@@ -0,0 +1,192 @@
+import threading
+import numpy as np
+
+import torch
+from torchvision import models, transforms
+
+from lib.backend.app.services.image_io import (
+    IMAGE_SIZE,
+    ImageDecodeError,
+    decode_error_message,
+    load_image,
+)
+from lib.backend.app.services.metrics import timed
+from lib.backend.app.services.query_views import make_views
+from lib.backend.app.services.inference_backends import build_backend, make_validation_batch
+from lib.backend.app.config import INFERENCE_BACKEND, TORCH_NUM_THREADS
+
+# ResNet50 の最終層を外したときの特徴量次元
+EMBEDDING_DIM = 2048
+
+# モデル・前処理の識別子。重みや前処理を変えたら必ず更新する
+# （増分更新時に既存の embedding を使い回せるかの判定に使う）
+MODEL_VERSION = f"resnet50-{models.ResNet50_Weights.DEFAULT.name.lower()}-fc_identity-{IMAGE_SIZE}"
+
+# ImageNet 正規化
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+def build_transform():
+    """
+    推論時の前処理（カタログ作成時と検索時で必ず同じものを使う）
+    """
+    return transforms.Compose([
+        transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+    ])
+
+
+def build_model(device: torch.device) -> torch.nn.Module:
+    """
+    分類層を除いた ResNet50（出力は 2048 次元の特徴量）
+    """
+    model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)
+    model.fc = torch.nn.Identity()
+    model = model.to(device)
+    model.eval()
+    return model
+
+
+class Embedder:
+    """
+    画像 → 特徴量 の変換を担当するコンポーネント
+
+    モデルは初回利用時（または warmup() 呼び出し時）に読み込む。
+    推論は backend_name のバックエンドで行う（検証に通らなければ eager）。
+    """
+
+    def __init__(self, device: str | None = None, backend_name: str = INFERENCE_BACKEND):
+        self.device = torch.device(
+            device if device else (
+                "cuda" if torch.cuda.is_available() else "cpu"
+            )
+        )
+        self.transform = build_transform()
+        self.backend_name = backend_name
+
+        self._backend = None
+        self.validation: dict | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    # 複数ワーカーでコアを奪い合わないように intra-op スレッド数を固定する
+                    if TORCH_NUM_THREADS > 0:
+                        torch.set_num_threads(TORCH_NUM_THREADS)
+                    model = build_model(self.device)
+
+                    batch = None
+                    if self.backend_name != "eager":
+                        batch = make_validation_batch(self.transform)
+                    self._backend, self.validation = build_backend(
+                        self.backend_name, model, self.device, batch
+                    )
+        return self._backend
+
+    @property
+    def loaded(self) -> bool:
+        return self._backend is not None
+
+    # -------------------------
+    def embed_tensors(self, batch: torch.Tensor) -> np.ndarray:
+        """
+        前処理済みの (N, 3, H, W) テンソルを特徴量 (N, 2048) に変換する
+        """
+        backend = self.backend
+        with timed("forward"):
+            return backend(batch)
+
+    def embed_images(self, images: list) -> np.ndarray:
+        """
+        PIL 画像のリストを1回の推論で特徴量 (N, 2048) に変換する
+        """
+        if not images:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+        with timed("transform"):
+            batch = torch.stack([self.transform(img) for img in images])
+        return self.embed_tensors(batch)
+
+    def embed_checked(self, sources: list) -> tuple[np.ndarray, list[str | None]]:
+        """
+        embed と同じだが、画像ごとの読み込みエラー（成功なら None）も返す
+        """
+        embeddings = np.zeros((len(sources), EMBEDDING_DIM), dtype=np.float32)
+        errors = [None] * len(sources)
+
+        images = []
+        loaded_rows = []
+        with timed("decode"):
+            for row, source in enumerate(sources):
+                try:
+                    images.append(load_image(source))
+                    loaded_rows.append(row)
+                except Exception as e:
+                    errors[row] = decode_error_message(e)
+
+        if images:
+            embeddings[loaded_rows] = self.embed_images(images)
+
+        return embeddings, errors
+
+    def embed_views(self, source, views: str = "none") -> np.ndarray:
+        """
+        1枚の画像から views のビュー（切り抜き・反転）を作り、1回の推論で (V, 2048) に変換する
+        """
+        with timed("decode"):
+            try:
+                img = load_image(source)
+            except Exception as e:
+                raise ImageDecodeError(decode_error_message(e)) from e
+        with timed("views"):
+            images = make_views(img, views)
+        return self.embed_images(images)
+
+    def embed_one(self, source) -> np.ndarray:
+        """
+        1枚の画像を特徴量 (2048,) に変換する。読み込めなければ ImageDecodeError
+        """
+        embeddings, errors = self.embed_checked([source])
+        if errors[0] is not None:
+            raise ImageDecodeError(errors[0])
+        return embeddings[0]
+
+    def embed(self, sources: list) -> np.ndarray:
+        """
+        画像（パス / bytes / ファイルライク）のリストを特徴量 (N, 2048) に変換する
+        読み込めなかった画像の行はゼロ埋めになる
+        """
+        embeddings, errors = self.embed_checked(sources)
+        for error in errors:
+            if error is not None:
+                print(f"Error in Embedder.embed: {error}")
+
+        return embeddings
+
+    def warmup(self, batch_sizes=(1,)):
+        """
+        モデルを読み込み、指定バッチサイズでダミー推論を1回ずつ実行する
+        """
+        for batch_size in batch_sizes:
+            dummy = torch.zeros((batch_size, 3, IMAGE_SIZE, IMAGE_SIZE))
+            self.embed_tensors(dummy)
+
+
+# ==========================================
+# プロセス内で共有する Embedder
+# ==========================================
+_embedders: dict[str, Embedder] = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder(device: str | None = None) -> Embedder:
+    key = device or "default"
+    with _embedders_lock:
+        if key not in _embedders:
+            _embedders[key] = Embedder(device)
+        return _embedders[key]
@@ -1,52 +1,80 @@
-import torch
-from torchvision import models, transforms
-from PIL import Image
 import numpy as np
 
+from lib.backend.app.services.batching import MicroBatcher
+from lib.backend.app.services.embedder import get_embedder
+from lib.backend.app.services.image_io import ImageDecodeError
+from lib.backend.app.services.executor import get_executor
+from lib.backend.app.config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+
 # ==========================================
-# 1. モデルと前処理の準備（起動時に一度だけ実行）
+# 1. モデル
 # ==========================================
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-# ResNet50の読み込み（保存時と同じ設定にする必要がある）
-model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)
-model.fc = torch.nn.Identity()  # 最後の分類層を削除して特徴量(2048次元)を取り出す
-model = model.to(device)
-model.eval()
-
-# 画像の前処理（保存時と同じ設定）
-IMAGE_SIZE = 224
-transform = transforms.Compose([
-    transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
-    transforms.ToTensor(),
-    transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],
-        std=[0.229, 0.224, 0.225],
-    ),
-])
+# ResNet50 の構築・前処理は embedder に一本化している。
+# モデルは初回の推論（または warmup）時に読み込まれる。
+
 
 # ==========================================
 # 2. 関数定義
 # ==========================================
-def create_embedding(image_path: str) -> np.ndarray:
+def create_embeddings(images: list) -> np.ndarray:
+    """
+    複数の画像（パス / bytes / ファイルライク）をまとめて
+    1回の推論で特徴量(N x 2048次元)に変換する
+    読み込めなかった画像の行はゼロ埋めになる
+    """
+    return get_embedder().embed(images)
+
+
+def create_embeddings_checked(images: list) -> tuple[np.ndarray, list[str | None]]:
     """
-    画像パスを受け取り、ResNet50で特徴量(2048次元)に変換して返す
+    create_embeddings と同じだが、画像ごとのエラー（成功なら None）も返す
     """
-    try:
-        # 画像を開く
-        img = Image.open(image_path).convert("RGB")
-        
-        # 前処理とTensor化
-        tensor = transform(img).unsqueeze(0).to(device)
+    return get_embedder().embed_checked(images)
 
-        # 推論実行（勾配計算なし）
-        with torch.no_grad():
-            embedding = model(tensor)
 
-        # Numpy配列に変換して1次元(フラット)にする
-        return embedding.cpu().numpy().flatten()
+def create_view_embeddings(image, views: str) -> np.ndarray:
+    """
+    1枚の画像から複数のビュー（切り抜き・反転）の特徴量 (V x 2048) を1回の推論で作る
+    """
+    return get_embedder().embed_views(image, views)
+
+
+def create_embedding(image) -> np.ndarray:
+    """
+    画像（パス / bytes / ファイルライク）を受け取り、
+    ResNet50で特徴量(2048次元)に変換して返す
+    読み込めない画像はゼロ埋めにせず ImageDecodeError を送出する
+    （ゼロベクトルで検索すると意味のない結果を返してしまうため）
+    """
+    return get_embedder().embed_one(image)
 
-    except Exception as e:
-        print(f"Error in create_embedding: {e}")
-        # エラー時はゼロ埋めの配列を返して落ちないようにする（または例外を投げる）
-        return np.zeros(2048)
\ No newline at end of file
+
+# ==========================================
+# 3. マイクロバッチ推論
+# ==========================================
+def _embed_batch(images: list) -> list:
+    """
+    バッチ推論用：画像ごとに特徴量、または読み込めなかった画像は ImageDecodeError を返す
+    """
+    embeddings, errors = create_embeddings_checked(images)
+    return [
+        embedding if error is None else ImageDecodeError(error)
+        for embedding, error in zip(embeddings, errors)
+    ]
+
+
+# 同時に届いたリクエストを数ミリ秒だけ待ってまとめ、1回の forward で処理する
+embedding_batcher = MicroBatcher(
+    _embed_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    get_executor=get_executor,
+)
+
+
+async def create_embedding_batched(image) -> np.ndarray:
+    """
+    create_embedding の非同期版。他のリクエストとまとめてバッチ推論する
+    読み込めない画像はゼロ埋めにせず ImageDecodeError を送出する
+    """
+    return await embedding_batcher.submit(image)
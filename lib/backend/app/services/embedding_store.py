@@ -0,0 +1,87 @@
+import os
+import shutil
+import time
+
+from lib.backend.app.config import (
+    EMBEDDINGS_DIR,
+    EMBEDDINGS_PATH,
+    IMAGE_IDS_PATH,
+    MANIFEST_PATH,
+    EMBEDDINGS_POINTER_PATH,
+    EMBEDDINGS_KEEP_GENERATIONS,
+)
+
+# ==========================================
+# embedding の世代管理
+# ==========================================
+# embeddings.npy / image_ids.json / manifest.json は組で意味を持つ
+# （行番号で対応する）。1ファイルずつ置き換えると、読み込み側が新しい
+# embeddings.npy と古い image_ids.json を組み合わせてしまうことがある。
+# そこで3ファイルを世代ごとのディレクトリ（gen-<時刻>）に書き、最後に
+# ポインタファイル（CURRENT）を1回の os.replace で差し替えて公開する。
+# 読み込み側は CURRENT を1回だけ読み、同じ世代の3ファイルを使う。
+# CURRENT が無い場合は従来の data/embeddings 直下のファイルを使う。
+
+EMBEDDINGS_FILENAME = "embeddings.npy"
+IMAGE_IDS_FILENAME = "image_ids.json"
+MANIFEST_FILENAME = "manifest.json"
+
+GENERATION_PREFIX = "gen-"
+
+
+def current_generation() -> str | None:
+    if not os.path.exists(EMBEDDINGS_POINTER_PATH):
+        return None
+    with open(EMBEDDINGS_POINTER_PATH, encoding="utf-8") as f:
+        return f.read().strip() or None
+
+
+def generation_paths(generation: str | None) -> tuple[str, str, str]:
+    """
+    世代の (embeddings.npy, image_ids.json, manifest.json) のパス。None なら従来のパス
+    """
+    if generation is None:
+        return EMBEDDINGS_PATH, IMAGE_IDS_PATH, MANIFEST_PATH
+
+    directory = os.path.join(EMBEDDINGS_DIR, generation)
+    return (
+        os.path.join(directory, EMBEDDINGS_FILENAME),
+        os.path.join(directory, IMAGE_IDS_FILENAME),
+        os.path.join(directory, MANIFEST_FILENAME),
+    )
+
+
+def resolve_paths() -> tuple[str, str, str]:
+    """
+    公開中の世代の (embeddings.npy, image_ids.json, manifest.json) のパス
+    """
+    return generation_paths(current_generation())
+
+
+def new_generation_dir() -> tuple[str, str]:
+    """
+    書き込み用の世代ディレクトリを作り、(世代名, パス) を返す（公開は publish で行う）
+    """
+    generation = f"{GENERATION_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    directory = os.path.join(EMBEDDINGS_DIR, generation)
+    os.makedirs(directory)
+    return generation, directory
+
+
+def publish(generation: str):
+    """
+    CURRENT を generation に差し替え、古い世代を削除する
+
+    読み込み中のプロセスがあっても困らないよう、直前の世代までは残す。
+    """
+    tmp = f"{EMBEDDINGS_POINTER_PATH}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(generation + "\n")
+    os.replace(tmp, EMBEDDINGS_POINTER_PATH)
+
+    generations = sorted(
+        name for name in os.listdir(EMBEDDINGS_DIR)
+        if name.startswith(GENERATION_PREFIX) and name != generation
+    )
+    for name in generations[:max(0, len(generations) - (EMBEDDINGS_KEEP_GENERATIONS - 1))]:
+        shutil.rmtree(os.path.join(EMBEDDINGS_DIR, name), ignore_errors=True)
@@ -0,0 +1,42 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.backend.app.config import INFERENCE_WORKERS
+
+# ==========================================
+# 推論・検索などブロッキング処理用のスレッドプール
+# ==========================================
+# イベントループのスレッドで PyTorch / numpy を動かすと他の接続が止まるため、
+# 重い処理はすべてここに逃がす。ワーカー数は INFERENCE_WORKERS で上限を決める。
+_executor: ThreadPoolExecutor | None = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=INFERENCE_WORKERS,
+            thread_name_prefix="inference",
+        )
+    return _executor
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    ブロッキング関数をスレッドプールで実行し、その結果を待つ
+    contextvars（リクエストごとの計測など）は呼び出し元のものを引き継ぐ
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(context.run, fn, *args, **kwargs)
+    )
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
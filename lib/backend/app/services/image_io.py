@@ -0,0 +1,39 @@
+import io
+from PIL import Image, UnidentifiedImageError
+
+# 推論時の入力サイズ（JPEG の draft 縮小の目安にも使う）
+IMAGE_SIZE = 224
+
+
+class ImageDecodeError(ValueError):
+    """
+    アップロードされた画像を読み込めない（API では 400 を返す）
+    """
+
+
+def decode_error_message(e: Exception) -> str:
+    """
+    読み込みエラーを API で返す文言にする
+
+    UnidentifiedImageError のメッセージには BytesIO の repr が入るため、固定の文言にする。
+    """
+    if isinstance(e, UnidentifiedImageError):
+        return "対応していない形式か、壊れた画像です"
+    return f"{type(e).__name__}: {e}"
+
+
+def load_image(source, draft_size: int = IMAGE_SIZE) -> Image.Image:
+    """
+    画像パス / bytes / ファイルライクオブジェクトから RGB 画像を読み込む
+
+    JPEG は draft() でデコード時に縮小するため、大きな写真でも
+    フル解像度に展開せずに済む（draft_size 以上のサイズは保たれる）。
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    img = Image.open(source)
+    if draft_size:
+        img.draft("RGB", (draft_size, draft_size))
+
+    return img.convert("RGB")
@@ -1,93 +1,105 @@
-import json
 import numpy as np
-from PIL import Image
 
-import torch
-from torchvision import models, transforms
-
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    return float(
-        np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-    )
+from lib.backend.app.services.embedder import get_embedder
+from lib.backend.app.services.search_service import active_index, search_index, search_index_batch
+from lib.backend.app.services.result_cache import ResultCache, cache_keys
+from lib.backend.app.services.query_views import check_mode, mode_key
+from lib.backend.app.config import QUERY_FUSION, QUERY_VIEW_MODE
 
 
 class ImageSearchService:
     def __init__(self, device: str | None = None):
-        self.device = torch.device(
-            device if device else (
-                "cuda" if torch.cuda.is_available() else "cpu"
-            )
-        )
-
-        # モデル
-        self.model = models.resnet50(
-            weights=models.ResNet50_Weights.DEFAULT
-        )
-        self.model.fc = torch.nn.Identity()
-        self.model = self.model.to(self.device)
-        self.model.eval()
-
-        # 前処理
-        self.transform = transforms.Compose([
-            transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225],
-            ),
-        ])
-
-        # データロード
-        self.embeddings = np.load(EMBEDDINGS_PATH)
-
-        with open(IMAGE_IDS_PATH, encoding="utf-8") as f:
-            self.image_ids = json.load(f)
-
-        with open(PRODUCTS_JSON_PATH, encoding="utf-8") as f:
-            self.products = json.load(f)
+        # モデル・前処理は共通の Embedder を使う（読み込みは初回推論時）
+        self.embedder = get_embedder(device)
+        self.device = self.embedder.device
 
-    # -------------------------
-    def _extract_embedding(self, image_path: str) -> np.ndarray:
-        img = Image.open(image_path).convert("RGB")
-        tensor = self.transform(img).unsqueeze(0).to(self.device)
+        # データはプロセス共通のインデックスを使う（再読み込みにも追従する）
+        active_index()
 
-        with torch.no_grad():
-            emb = self.model(tensor)
+        # 同じ画像（bytes）の再検索用キャッシュ（インデックス更新時に破棄される）
+        self.cache = ResultCache()
 
-        return emb.cpu().numpy().flatten()
+    # -------------------------
+    def _extract_embedding(self, image) -> np.ndarray:
+        # image は画像パス / bytes / ファイルライクのいずれか（読み込めなければ ImageDecodeError）
+        return self.embedder.embed_one(image)
 
-    @staticmethod
-    def _cosine_similarity(a, b) -> float:
-        return float(
-            np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-        )
+    def _extract_view_embeddings(self, image, views: str) -> np.ndarray:
+        # 切り抜き・反転した複数ビューを1回の推論で (V, 2048) にする
+        return self.embedder.embed_views(image, views)
+
+    # -------------------------
+    def search(
+        self,
+        image,
+        top_k: int = 3,
+        filters: dict | None = None,
+        views: str = QUERY_VIEW_MODE,
+        fusion: str = QUERY_FUSION,
+    ) -> list[dict]:
+        """
+        views が "none" 以外なら複数ビューのスコアを fusion（max / mean）で統合して検索する
+        """
+        return self.search_with_status(image, top_k, filters, views, fusion)["results"]
+
+    def search_with_status(
+        self,
+        image,
+        top_k: int = 3,
+        filters: dict | None = None,
+        views: str = QUERY_VIEW_MODE,
+        fusion: str = QUERY_FUSION,
+    ) -> dict:
+        """
+        search と同じだが {"results": [...], "partial": bool} を返す
+        （partial はシャード分割時に一部のシャードが応答しなかった場合に True）
+        """
+        check_mode(views, fusion)
+        mode = mode_key(views, fusion)
+        version = active_index().version
+
+        # bytes で渡された場合のみキャッシュを使う
+        keys = cache_keys(image, top_k, filters, mode=mode) if isinstance(image, bytes) else None
+        if keys is not None:
+            cached = self.cache.get(keys, version)
+            if cached is not None:
+                return {"results": cached, "partial": False}
+
+        if mode is None:
+            query_emb = self._extract_embedding(image)
+            found = search_index(query_emb, top_k, filters)
+        else:
+            view_embs = self._extract_view_embeddings(image, views)
+            found = search_index(view_embs, top_k, filters, fusion)
+        for r in found["results"]:
+            r["similarity"] = round(r["similarity"], 3)
+
+        if keys is not None and not found["partial"]:
+            self.cache.put(keys, version, found["results"])
+
+        return found
 
     # -------------------------
-    def search(self, image_path: str, top_k: int = 3) -> list[dict]:
-        query_emb = self._extract_embedding(image_path)
-
-        scores = []
-        for idx, emb in enumerate(self.embeddings):
-            score = self._cosine_similarity(query_emb, emb)
-            scores.append((idx, score))
-
-        scores.sort(key=lambda x: x[1], reverse=True)
-        top_results = scores[:top_k]
-
-        results = []
-        for rank, (idx, score) in enumerate(top_results, start=1):
-            image_id = self.image_ids[idx]
-            product = next(
-                p for p in self.products
-                if p["image"].endswith(image_id)
-            )
-
-            results.append({
-                "rank": rank,
-                "similarity": round(score, 3),
-                "brand": product["brand"],
-                "model": f"{product['series']} {product['model']}",
-                "image": image_id
-            })
-
-        return results
+    def search_batch(self, images: list, top_k: int = 3, filters: dict | None = None) -> list[dict]:
+        """
+        複数画像を1回の推論・1回の行列積でまとめて検索する
+
+        戻り値は画像ごとに {"results": [...]} または {"error": "..."}。
+        一部のシャードが応答しなかった場合は成功した画像に "partial": True が付く。
+        """
+        embeddings, errors = self.embedder.embed_checked(images)
+
+        ok_rows = [i for i, error in enumerate(errors) if error is None]
+        found = {"results": [], "partial": False}
+        if ok_rows:
+            found = search_index_batch(embeddings[ok_rows], top_k, filters)
+
+        items = [{"error": error} for error in errors]
+        for row, row_results in zip(ok_rows, found["results"]):
+            for r in row_results:
+                r["similarity"] = round(r["similarity"], 3)
+            items[row] = {"results": row_results}
+            if found["partial"]:
+                items[row]["partial"] = True
+
+        return items
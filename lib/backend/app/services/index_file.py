@@ -0,0 +1,220 @@
+import os
+import json
+import struct
+import time
+import numpy as np
+
+from lib.backend.app.services.similarity import STORAGE_DTYPES
+
+# ==========================================
+# インデックスファイル形式（.ccidx）
+# ==========================================
+# [0:8]    マジック "CCIDX" + 予約
+# [8:10]   フォーマットバージョン (uint16, little endian)
+# [10:14]  ヘッダ長 (uint32)
+# [14:..]  ヘッダ（UTF-8 JSON）
+# data_offset 以降（ALIGNMENT 境界）: ベクトル本体 count x dim（dtype）
+# scales_offset 以降: int8 の場合のみ行ごとのスケール（float32 x count）
+# meta_offset 以降: image_ids / 行ごとの商品情報（UTF-8 JSON）
+#
+# ベクトル本体は np.memmap で読み取り専用にマップするので、
+# 同じホストの全ワーカーがページキャッシュを共有できる。
+MAGIC = b"CCIDX\x00\x00\x00"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct("<8sHI")
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_index_file(
+    path: str,
+    matrix: np.ndarray,
+    image_ids: list[str],
+    row_products: list[dict | None],
+    scales: np.ndarray | None = None,
+    normalized: bool = True,
+    model_id: str = "unknown",
+):
+    """
+    保存用行列（正規化・dtype 変換済み）と行ごとのメタデータを1ファイルに書き出す
+
+    一時ファイルに書いてから rename するので、読み込み側が途中の状態を見ることはない。
+    """
+    dtype = np.dtype(matrix.dtype).name
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"未対応の dtype です: {dtype}")
+    if len(matrix) != len(image_ids) or len(image_ids) != len(row_products):
+        raise ValueError("行列・image_ids・商品情報の件数が一致しません")
+    if (dtype == "int8") != (scales is not None):
+        raise ValueError("int8 の場合のみ scales が必要です")
+
+    count, dim = matrix.shape
+    meta = json.dumps(
+        {"image_ids": image_ids, "products": row_products},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    # ヘッダ長がオフセットに依存するので、十分な大きさを先に確保しておく
+    header_reserve = 1024
+    data_offset = _align(_PREFIX.size + header_reserve)
+    data_nbytes = count * dim * matrix.itemsize
+    scales_offset = _align(data_offset + data_nbytes)
+    scales_nbytes = count * 4 if scales is not None else 0
+    meta_offset = _align(scales_offset + scales_nbytes)
+
+    header = json.dumps({
+        "format_version": FORMAT_VERSION,
+        "count": count,
+        "dim": dim,
+        "dtype": dtype,
+        "normalized": normalized,
+        "model_id": model_id,
+        "created_at": int(time.time()),
+        "data_offset": data_offset,
+        "data_nbytes": data_nbytes,
+        "scales_offset": scales_offset if scales is not None else None,
+        "meta_offset": meta_offset,
+        "meta_nbytes": len(meta),
+    }).encode("utf-8")
+    if len(header) > header_reserve:
+        raise ValueError("ヘッダが大きすぎます")
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+
+        f.seek(data_offset)
+        # 大きな行列でも一度にコピーしないようにブロック単位で書く
+        for start in range(0, count, 8192):
+            f.write(np.ascontiguousarray(matrix[start:start + 8192]).tobytes())
+
+        if scales is not None:
+            f.seek(scales_offset)
+            f.write(np.asarray(scales, dtype="<f4").tobytes())
+
+        f.seek(meta_offset)
+        f.write(meta)
+
+    os.replace(tmp, path)
+
+
+def read_header(path: str) -> dict:
+    with open(path, "rb") as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError(f"インデックスファイルが短すぎます: {path}")
+
+        magic, version, header_len = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"インデックスファイルではありません: {path}")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"未対応のフォーマットバージョンです: {version}")
+
+        return json.loads(f.read(header_len).decode("utf-8"))
+
+
+def open_index_file(path: str):
+    """
+    インデックスファイルを開く
+
+    戻り値は (ベクトル行列 memmap, スケール or None, image_ids, 行ごとの商品, ヘッダ)。
+    ベクトル行列・スケールはコピーせずに読み取り専用でマップする。
+    """
+    header = read_header(path)
+    count, dim = header["count"], header["dim"]
+
+    matrix = np.memmap(
+        path,
+        dtype=np.dtype(header["dtype"]),
+        mode="r",
+        offset=header["data_offset"],
+        shape=(count, dim),
+    )
+
+    scales = None
+    if header.get("scales_offset") is not None:
+        scales = np.memmap(
+            path, dtype="<f4", mode="r", offset=header["scales_offset"], shape=(count,)
+        )
+
+    with open(path, "rb") as f:
+        f.seek(header["meta_offset"])
+        meta = json.loads(f.read(header["meta_nbytes"]).decode("utf-8"))
+
+    return matrix, scales, meta["image_ids"], meta["products"], header
+
+
+def validate_index_file(path: str, norm_tolerance: float = 1e-2, block_rows: int = 8192) -> list[str]:
+    """
+    インデックスファイルの整合性を確認し、問題点のリストを返す（空なら正常）
+    """
+    errors = []
+
+    try:
+        header = read_header(path)
+    except (OSError, ValueError) as e:
+        return [str(e)]
+
+    for key in ("count", "dim", "dtype", "normalized", "model_id",
+                "data_offset", "data_nbytes", "meta_offset", "meta_nbytes"):
+        if key not in header:
+            errors.append(f"ヘッダに {key} がありません")
+    if errors:
+        return errors
+
+    if header["dtype"] not in STORAGE_DTYPES:
+        errors.append(f"未対応の dtype です: {header['dtype']}")
+        return errors
+
+    itemsize = np.dtype(header["dtype"]).itemsize
+    expected = header["count"] * header["dim"] * itemsize
+    if header["data_nbytes"] != expected:
+        errors.append(f"data_nbytes が不正です: {header['data_nbytes']} != {expected}")
+    if header["data_offset"] % ALIGNMENT != 0:
+        errors.append(f"data_offset が {ALIGNMENT} バイト境界にありません")
+
+    file_size = os.path.getsize(path)
+    if header["meta_offset"] + header["meta_nbytes"] > file_size:
+        errors.append("ファイルサイズがヘッダの記述より小さいです")
+        return errors
+
+    matrix, scales, image_ids, products, _ = open_index_file(path)
+
+    if len(image_ids) != header["count"]:
+        errors.append(f"image_ids の件数が不正です: {len(image_ids)} != {header['count']}")
+    if len(products) != header["count"]:
+        errors.append(f"商品情報の件数が不正です: {len(products)} != {header['count']}")
+
+    duplicates = len(image_ids) - len(set(image_ids))
+    if duplicates:
+        errors.append(f"image_ids に重複があります: {duplicates} 件")
+
+    missing = sum(1 for p in products if p is None)
+    if missing:
+        errors.append(f"商品情報のない行があります: {missing} 件")
+
+    # 値のチェックはブロック単位で行い、行列全体をメモリに載せない
+    bad_values = 0
+    bad_norms = 0
+    for start in range(0, header["count"], block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        if scales is not None:
+            block = block * np.asarray(scales[start:start + block_rows])[:, None]
+
+        bad_values += int((~np.isfinite(block)).any(axis=1).sum())
+        if header["normalized"]:
+            norms = np.linalg.norm(block, axis=1)
+            bad_norms += int(((np.abs(norms - 1.0) > norm_tolerance) & (norms > 0)).sum())
+
+    if bad_values:
+        errors.append(f"NaN / Inf を含む行があります: {bad_values} 件")
+    if bad_norms:
+        errors.append(f"正規化されていない行があります: {bad_norms} 件")
+
+    return errors
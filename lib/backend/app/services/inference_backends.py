@@ -0,0 +1,231 @@
+import os
+import copy
+import numpy as np
+
+import torch
+
+from lib.backend.app.config import (
+    ONNX_MODEL_PATH,
+    INFERENCE_MIN_COSINE,
+    INFERENCE_VALIDATION_DIR,
+    INFERENCE_VALIDATION_IMAGES,
+    TORCH_NUM_THREADS,
+)
+from lib.backend.app.services.image_io import IMAGE_SIZE, load_image
+
+# ==========================================
+# 推論バックエンド
+# ==========================================
+# どのバックエンドも「前処理済み (N, 3, H, W) テンソル → 特徴量 (N, 2048) の
+# float32 配列」を返す呼び出し可能オブジェクトとして扱う。
+# eager 以外は eager の出力（基準）とのコサイン類似度を確認してから使う。
+
+BACKENDS = ("eager", "torchscript", "onnx", "int8")
+
+
+class EagerBackend:
+    name = "eager"
+
+    def __init__(self, model: torch.nn.Module, device: torch.device):
+        self.model = model
+        self.device = device
+
+    def __call__(self, batch: torch.Tensor) -> np.ndarray:
+        with torch.inference_mode():
+            output = self.model(batch.to(self.device))
+        return output.cpu().numpy().astype(np.float32, copy=False)
+
+
+class TorchScriptBackend(EagerBackend):
+    """
+    trace + freeze した TorchScript（BatchNorm の畳み込みへの折り込みなどが効く）
+    """
+    name = "torchscript"
+
+    @classmethod
+    def build(cls, model: torch.nn.Module, device: torch.device) -> "TorchScriptBackend":
+        example = torch.zeros((1, 3, IMAGE_SIZE, IMAGE_SIZE), device=device)
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+            frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+        return cls(frozen, device)
+
+
+class QuantizedBackend(EagerBackend):
+    """
+    int8 静的量子化（FX グラフモード、x86 向け）。CPU 専用
+
+    ResNet50 の計算はほぼ畳み込みで、動的量子化は Linear にしか効かない
+    （fc を外したこのモデルでは何も変わらない）ため、校正データを使う静的量子化にする。
+    """
+    name = "int8"
+
+    @classmethod
+    def build(cls, model: torch.nn.Module, calibration: torch.Tensor) -> "QuantizedBackend":
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        # 量子化は元のモデルを書き換えるので複製して使う
+        float_model = copy.deepcopy(model).cpu().eval()
+
+        example = calibration[:1]
+        prepared = prepare_fx(float_model, get_default_qconfig_mapping("x86"), (example,))
+        with torch.inference_mode():
+            for start in range(0, len(calibration), 8):
+                prepared(calibration[start:start + 8])
+
+        return cls(convert_fx(prepared), torch.device("cpu"))
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime（CPUExecutionProvider）。onnxruntime がなければ ImportError
+    """
+    name = "onnx"
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    @classmethod
+    def build(cls, model: torch.nn.Module, path: str = ONNX_MODEL_PATH) -> "OnnxBackend":
+        import onnxruntime as ort
+
+        if not os.path.exists(path):
+            export_onnx(model, path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if TORCH_NUM_THREADS > 0:
+            options.intra_op_num_threads = TORCH_NUM_THREADS
+
+        session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        return cls(session)
+
+    def __call__(self, batch: torch.Tensor) -> np.ndarray:
+        inputs = {self.input_name: batch.cpu().numpy()}
+        return self.session.run(None, inputs)[0].astype(np.float32, copy=False)
+
+
+def export_onnx(model: torch.nn.Module, path: str):
+    """
+    バッチサイズ可変の ONNX モデルを書き出す
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    example = torch.zeros((1, 3, IMAGE_SIZE, IMAGE_SIZE))
+
+    tmp = f"{path}.tmp"
+    torch.onnx.export(
+        copy.deepcopy(model).cpu().eval(),
+        example,
+        tmp,
+        input_names=["images"],
+        output_names=["embeddings"],
+        dynamic_axes={"images": {0: "batch"}, "embeddings": {0: "batch"}},
+        opset_version=17,
+    )
+    os.replace(tmp, path)
+
+
+# ==========================================
+# 検証
+# ==========================================
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    """
+    行ごとのコサイン類似度（基準 vs 候補）の最小・平均を返す
+    """
+    ref = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    cand = candidate / np.maximum(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12)
+    cos = np.einsum("ij,ij->i", ref, cand)
+    return {"min_cosine": float(cos.min()), "mean_cosine": float(cos.mean())}
+
+
+def validate_backend(
+    backend,
+    reference: np.ndarray,
+    batch: torch.Tensor,
+    min_cosine: float = INFERENCE_MIN_COSINE,
+) -> dict:
+    """
+    候補バックエンドの出力が基準の embedding と一致するか確認する
+
+    戻り値の "ok" が False のバックエンドは使わない。
+    """
+    report = cosine_agreement(reference, backend(batch))
+    report["ok"] = report["min_cosine"] >= min_cosine
+    return report
+
+
+def build_backend(
+    name: str,
+    model: torch.nn.Module,
+    device: torch.device,
+    validation_batch: torch.Tensor,
+):
+    """
+    指定のバックエンドを作り、検証に通れば返す
+
+    作成・検証に失敗した場合は [WARN] を出して eager を返す。
+    戻り値は (バックエンド, 検証結果 or None)。
+    """
+    eager = EagerBackend(model, device)
+    if name == "eager":
+        return eager, None
+
+    if name not in BACKENDS:
+        raise ValueError(f"未対応の推論バックエンドです: {name}")
+
+    check_batch = validation_batch
+    try:
+        if name == "torchscript":
+            backend = TorchScriptBackend.build(model, device)
+        elif name == "onnx":
+            backend = OnnxBackend.build(model)
+        else:
+            if len(validation_batch) < 2:
+                raise ValueError("int8 の校正・検証には2枚以上の画像が必要です")
+            # 校正は前半の画像だけで行い、検証は校正に使っていない後半だけで行う
+            n_calibration = len(validation_batch) // 2
+            backend = QuantizedBackend.build(model, validation_batch[:n_calibration])
+            check_batch = validation_batch[n_calibration:]
+    except Exception as e:
+        print(f"[WARN] 推論バックエンド {name} を作成できないため eager を使います: {e}")
+        return eager, None
+
+    reference = eager(check_batch)
+    report = validate_backend(backend, reference, check_batch)
+
+    if not report["ok"]:
+        print(
+            f"[WARN] 推論バックエンド {name} の出力が基準と一致しないため eager を使います"
+            f"（min cosine={report['min_cosine']:.4f}）"
+        )
+        return eager, report
+
+    print(f"[OK] 推論バックエンド {name}（min cosine={report['min_cosine']:.4f}）")
+    return backend, report
+
+
+def make_validation_batch(
+    transform,
+    image_dir: str = INFERENCE_VALIDATION_DIR,
+    n: int = INFERENCE_VALIDATION_IMAGES,
+) -> torch.Tensor:
+    """
+    検証（int8 では校正も兼ねる）に使う前処理済みテンソルを作る
+
+    カタログの画像があればそれを使い、なければ乱数画像で代用する。
+    """
+    tensors = []
+    if os.path.isdir(image_dir):
+        for filename in sorted(os.listdir(image_dir))[:n]:
+            try:
+                tensors.append(transform(load_image(os.path.join(image_dir, filename))))
+            except Exception:
+                continue
+
+    if not tensors:
+        generator = torch.Generator().manual_seed(0)
+        return torch.randn((n, 3, IMAGE_SIZE, IMAGE_SIZE), generator=generator)
+
+    return torch.stack(tensors)
@@ -0,0 +1,226 @@
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# ==========================================
+# Prometheus 形式のメトリクス
+# ==========================================
+# 外部ライブラリは使わず、/metrics で返すテキスト形式だけを実装する。
+
+# レイテンシ用のバケット（秒）
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """
+    ラベルごとの累積ヒストグラム（スレッドセーフ）
+    """
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [バケットごとの件数..., +Inf の件数, 合計]
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+                )
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {series[-1]}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class Counter:
+    """
+    ラベルごとの単調増加カウンタ（スレッドセーフ）
+    """
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labels, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """
+    描画時に関数を呼んで値を取るメトリクス（キュー長・キャッシュのヒット数など）
+    他のモジュールが持っている集計値をそのまま公開するために使う
+    """
+
+    def __init__(self, name: str, help: str, fn, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+            f"{self.name} {float(self.fn())}",
+        ]
+
+
+_registry: list = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = register(Histogram(
+    "conecone_stage_seconds",
+    "Time spent in each processing stage",
+    labelnames=("stage",),
+))
+REQUEST_SECONDS = register(Histogram(
+    "conecone_request_seconds",
+    "End-to-end request latency",
+    labelnames=("path",),
+))
+REQUESTS_TOTAL = register(Counter(
+    "conecone_requests_total",
+    "Number of HTTP requests",
+    labelnames=("path", "status"),
+))
+
+
+# ==========================================
+# 処理段階ごとの計測
+# ==========================================
+# リクエスト中の各段階の所要時間を集める（構造化ログ用）。
+# run_blocking は contextvars を引き継ぐので、スレッドプール内の計測もここに入る。
+_current_trace: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "conecone_trace", default=None
+)
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    with timed("forward"): ... の所要時間をヒストグラムとリクエストの記録に加える
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+
+        trace = _current_trace.get()
+        if trace is not None:
+            trace[stage] = trace.get(stage, 0.0) + elapsed
+
+
+def start_trace() -> tuple[dict, contextvars.Token]:
+    trace = {}
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token: contextvars.Token):
+    _current_trace.reset(token)
+
+
+def current_trace() -> dict | None:
+    return _current_trace.get()
+
+
+def add_stages(trace: dict | None, stages: dict):
+    """
+    別の場所（マイクロバッチのワーカーなど）で計測した段階の時間をリクエストの記録に加える
+    """
+    if trace is None:
+        return
+    for stage, elapsed in stages.items():
+        trace[stage] = trace.get(stage, 0.0) + elapsed
+
+
+# ==========================================
+# 構造化ログ
+# ==========================================
+request_logger = logging.getLogger("conecone.request")
+
+
+def enable_request_log():
+    """
+    リクエストログを標準エラーに出す（uvicorn はこのロガーを設定しないため）
+    """
+    if not request_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        request_logger.addHandler(handler)
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+
+
+def log_request(path: str, status: int, duration: float, stages: dict, **fields):
+    """
+    1リクエスト1行の JSON ログを出す
+    """
+    record = {
+        "event": "request",
+        "path": path,
+        "status": status,
+        "duration_ms": round(duration * 1000.0, 3),
+        "stages_ms": {k: round(v * 1000.0, 3) for k, v in stages.items()},
+        **fields,
+    }
+    request_logger.info(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,91 @@
+from PIL import Image, ImageEnhance, ImageOps
+
+from lib.backend.app.config import QUERY_CROP_FRACTION
+
+# ==========================================
+# 検索クエリの複数ビュー
+# ==========================================
+# スマホで撮った写真は商品が中央にないことが多い。カタログ側は
+# scripts/preprocess_image.py で中央トリミング + 明るさ・コントラスト補正を
+# しているので、クエリも同様の切り抜き・反転を何通りか作って1回の推論で
+# まとめて embedding にし、スコアを統合（max / mean）してから top-k を取る。
+
+# scripts/preprocess_image.py と同じ補正値
+BRIGHTNESS = 1.1
+CONTRAST = 1.2
+
+# モード → 作るビュー（ビュー数 = 推論のバッチサイズ）
+VIEW_SETS = {
+    "none": ("full",),
+    "center": ("center",),
+    "flip": ("full", "full_flip"),
+    "crops": ("full", "center", "top_left", "top_right", "bottom_left", "bottom_right"),
+    "all": (
+        "full", "full_flip", "center", "center_flip",
+        "top_left", "top_right", "bottom_left", "bottom_right",
+    ),
+}
+
+FUSIONS = ("max", "mean")
+
+
+def check_mode(views: str, fusion: str):
+    if views not in VIEW_SETS:
+        raise ValueError(f"未対応のビュー指定です: {views}（{', '.join(VIEW_SETS)}）")
+    if fusion not in FUSIONS:
+        raise ValueError(f"未対応のスコア統合方法です: {fusion}（{', '.join(FUSIONS)}）")
+
+
+def mode_key(views: str, fusion: str) -> str | None:
+    """
+    キャッシュキー用のモード文字列（1枚のみの検索なら None）
+    """
+    return None if views == "none" else f"{views}-{fusion}"
+
+
+def _square_box(size: tuple[int, int], side: int, position: str) -> tuple[int, int, int, int]:
+    w, h = size
+    left = {"left": 0, "center": (w - side) // 2, "right": w - side}
+    top = {"top": 0, "center": (h - side) // 2, "bottom": h - side}
+
+    if position == "center":
+        x, y = left["center"], top["center"]
+    else:
+        vertical, horizontal = position.split("_")
+        x, y = left[horizontal], top[vertical]
+    return (x, y, x + side, y + side)
+
+
+def _catalog_style(img: Image.Image) -> Image.Image:
+    """
+    カタログ画像と同じ 中央トリミング + 明るさ・コントラスト補正
+    """
+    img = img.crop(_square_box(img.size, min(img.size), "center"))
+    img = ImageEnhance.Brightness(img).enhance(BRIGHTNESS)
+    return ImageEnhance.Contrast(img).enhance(CONTRAST)
+
+
+def make_views(img: Image.Image, views: str = "none") -> list[Image.Image]:
+    """
+    RGB 画像から views の指定どおりのビュー（PIL 画像）のリストを作る
+    """
+    names = VIEW_SETS[views]
+
+    center = None
+    side = max(1, int(min(img.size) * QUERY_CROP_FRACTION))
+
+    result = []
+    for name in names:
+        base = name.removesuffix("_flip")
+        if base == "full":
+            view = img
+        elif base == "center":
+            if center is None:
+                center = _catalog_style(img)
+            view = center
+        else:
+            view = img.crop(_square_box(img.size, side, base))
+
+        result.append(ImageOps.mirror(view) if name.endswith("_flip") else view)
+
+    return result
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from lib.backend.app.config import (
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL,
+    RESULT_CACHE_PERCEPTUAL,
+    RESULT_CACHE_MAX_DISTANCE,
+)
+from lib.backend.app.services.image_io import load_image
+
+# 知覚ハッシュ（dHash）の一辺のサイズ（HASH_SIZE^2 ビット）
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+
+def content_key(data: bytes) -> str:
+    """
+    画像のバイト列そのもののハッシュ（完全一致用）
+    """
+    return "c:" + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_key(data: bytes) -> str:
+    """
+    dHash による知覚ハッシュ（再圧縮・縮小された同じ写真でも一致しやすい）
+    """
+    img = load_image(data, draft_size=HASH_SIZE * 4).convert("L")
+    pixels = list(img.resize((HASH_SIZE + 1, HASH_SIZE)).getdata())
+
+    bits = 0
+    for y in range(HASH_SIZE):
+        row = pixels[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+        for x in range(HASH_SIZE):
+            bits = (bits << 1) | int(row[x] < row[x + 1])
+
+    return f"p:{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def _hamming(a: str, b: str) -> int | None:
+    """
+    同じ検索条件の知覚ハッシュキー同士のハミング距離（比較できなければ None）
+    """
+    a_hash, a_options = a[2:].split(":", 1)
+    b_hash, b_options = b[2:].split(":", 1)
+    if a_options != b_options:
+        return None
+    return (int(a_hash, 16) ^ int(b_hash, 16)).bit_count()
+
+
+def _bucket_keys(key: str, n_chunks: int) -> list[tuple[int, int, str]]:
+    """
+    知覚ハッシュを n_chunks 個のビット列に分けた (番号, 値, 検索条件) のリスト
+
+    距離 d 以内のハッシュ同士は、d+1 個に分けたうち少なくとも1個が完全に一致する
+    （鳩の巣原理）。一致するチャンクを持つキーだけを比べれば取りこぼしはない。
+    """
+    hash_hex, options = key[2:].split(":", 1)
+    bits = int(hash_hex, 16)
+
+    buckets = []
+    for i in range(n_chunks):
+        start = HASH_BITS * i // n_chunks
+        stop = HASH_BITS * (i + 1) // n_chunks
+        value = (bits >> start) & ((1 << (stop - start)) - 1)
+        buckets.append((i, value, options))
+    return buckets
+
+
+def cache_keys(
+    data: bytes,
+    top_k: int,
+    filters: dict | None = None,
+    perceptual: bool = RESULT_CACHE_PERCEPTUAL,
+    mode: str | None = None,
+) -> list[str]:
+    """
+    検索結果キャッシュのキー（完全一致 → 知覚ハッシュ の順）を返す
+
+    検索条件（top_k・絞り込み・クエリのビュー指定 mode）もキーに含める。
+    perceptual=True の場合は画像のデコードが入るので、イベントループ外で呼ぶこと。
+    """
+    options = f"{top_k}"
+    if filters:
+        options += ":" + json.dumps(filters, ensure_ascii=False, sort_keys=True)
+    if mode:
+        options += f":{mode}"
+
+    keys = [f"{content_key(data)}:{options}"]
+    if perceptual:
+        try:
+            keys.append(f"{perceptual_key(data)}:{options}")
+        except Exception:
+            # 読み込めない画像は完全一致のキーだけにする
+            pass
+    return keys
+
+
+class ResultCache:
+    """
+    検索結果の LRU + TTL キャッシュ（スレッドセーフ）
+
+    エントリにはインデックスの version を記録し、version が変わったら
+    まとめて破棄する（再読み込み後に古い結果を返さないため）。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_SIZE,
+        ttl: float = RESULT_CACHE_TTL,
+        max_distance: int = RESULT_CACHE_MAX_DISTANCE,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.version = None
+
+        self._entries: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 知覚ハッシュのキーをハッシュの一部ごとに分類した表（近いキーの候補探し用）
+        self._n_chunks = min(max(1, max_distance + 1), HASH_BITS)
+        self._buckets: dict[tuple[int, int, str], set[str]] = {}
+
+        # メトリクス
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    # -------------------------
+    def _is_stale(self, version: int) -> bool:
+        # 差し替え前のインデックスを見ていたリクエスト（古い version）は、
+        # 新しい version の結果を消さないようキャッシュに触れさせない
+        return self.version is not None and version < self.version
+
+    def _check_version(self, version: int):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._clear()
+            self.version = version
+
+    def _clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+    def _add(self, key: str, entry: tuple):
+        if key.startswith("p:") and key not in self._entries:
+            for bucket in _bucket_keys(key, self._n_chunks):
+                self._buckets.setdefault(bucket, set()).add(key)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+    def _remove(self, key: str):
+        del self._entries[key]
+        if key.startswith("p:"):
+            for bucket in _bucket_keys(key, self._n_chunks):
+                keys = self._buckets.get(bucket)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._buckets[bucket]
+
+    def _nearest(self, key: str) -> str | None:
+        """
+        知覚ハッシュが max_distance ビット以内の既存キーを探す
+
+        全キーは走査せず、ハッシュの一部が一致するキー（_buckets）だけを比べる。
+        """
+        candidates = set()
+        for bucket in _bucket_keys(key, self._n_chunks):
+            candidates |= self._buckets.get(bucket, set())
+
+        best, best_distance = None, self.max_distance + 1
+        for other in candidates:
+            distance = _hamming(key, other)
+            if distance is not None and distance < best_distance:
+                best, best_distance = other, distance
+        return best
+
+    def get(self, keys: list[str], version: int) -> list[dict] | None:
+        """
+        いずれかのキーに一致する結果を返す（なければ None）
+        知覚ハッシュのキーは max_distance ビット以内の差なら一致とみなす
+        """
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            if self._is_stale(version):
+                self.misses += 1
+                return None
+            self._check_version(version)
+
+            for key in keys:
+                if key not in self._entries and key.startswith("p:") and self.max_distance > 0:
+                    key = self._nearest(key) or key
+
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+
+                expires_at, results = entry
+                if expires_at < now:
+                    self._remove(key)
+                    self.expirations += 1
+                    continue
+
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # 呼び出し元が書き換えても影響しないようにコピーを返す
+                return [dict(r) for r in results]
+
+            self.misses += 1
+            return None
+
+    def put(self, keys: list[str], version: int, results: list[dict]):
+        if not self.enabled:
+            return
+
+        expires_at = time.monotonic() + self.ttl
+        stored = [dict(r) for r in results]
+
+        with self._lock:
+            # 検索中にインデックスが差し替わった場合（古い version の結果）は保存しない
+            if self._is_stale(version):
+                return
+            self._check_version(version)
+
+            for key in keys:
+                self._add(key, (expires_at, stored))
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "index_version": self.version,
+        }
+
+
+# ==========================================
+# /predict 用のプロセス共通キャッシュ
+# ==========================================
+result_cache = ResultCache()
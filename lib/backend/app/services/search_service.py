@@ -1,79 +1,72 @@
-import os
-import json
 import numpy as np
-from lib.backend.app.services.image_search_service import cosine_similarity
-from lib.backend.app.config import TOP_K, EMBEDDINGS_PATH, PRODUCTS_JSON_PATH, IMAGE_IDS_PATH, BASE_DIR
+from lib.backend.app.services.vector_index import get_index
+from lib.backend.app.services.sharding import get_sharded_index, sharded_index_size
+from lib.backend.app.config import TOP_K, SEARCH_SHARDED
 
-# products.json のパスを定義（configにない場合を想定して計算）
-#PRODUCTS_JSON_PATH = os.path.join(BASE_DIR, "data", "products.json")
 
-def search_similar(query_embedding: np.ndarray):
+def active_index():
     """
-    query_embedding と保存済み embeddings.npy を比較して
-    詳細情報（ブランド、モデル等）付きの類似結果を返す
+    検索に使うインデックス（SEARCH_SHARDED なら ShardedIndex、それ以外は VectorIndex）
+    """
+    return get_sharded_index() if SEARCH_SHARDED else get_index()
+
+
+def index_size() -> int:
+    """
+    検索に使うインデックスの件数（シャード分割時はワーカーを起動せず、起動前は 0）
     """
+    return sharded_index_size() if SEARCH_SHARDED else len(get_index())
 
-    # 1. データ読み込み
-    embeddings = np.load(EMBEDDINGS_PATH)
 
-    # image_ids.json の読み込み
-    base_dir = os.path.dirname(EMBEDDINGS_PATH)
-    ids_path = os.path.join(base_dir, "image_ids.json")
-    with open(ids_path, "r", encoding="utf-8") as f:
-        image_ids = json.load(f)
+def search_filters(brand: str | None = None, series: str | None = None, year: str | None = None) -> dict:
+    """
+    API の絞り込みパラメータを filters の dict にする（指定の無い項目は含めない）
+    """
+    filters = {"brand": brand, "series": series, "year": year}
+    return {k: v for k, v in filters.items() if v}
 
-    # products.json の読み込み（詳細情報取得用）
-    with open(PRODUCTS_JSON_PATH, "r", encoding="utf-8") as f:
-        products = json.load(f)
 
-    results = []
+def search_similar(query_embedding: np.ndarray, filters: dict | None = None):
+    """
+    query_embedding と保存済み embeddings.npy を比較して
+    詳細情報（ブランド、モデル等）付きの類似結果を返す
+    """
+    # 起動時に読み込み済みのインデックスに対して、
+    # 行列積1回 + argpartition で上位 TOP_K 件を求める
+    # filters（brand / series / year）があれば一致する行だけを対象にする
+    return get_index().search(query_embedding, TOP_K, filters)
 
-    # 2. 全件比較
-    for idx, db_embedding in enumerate(embeddings):
-        score = cosine_similarity(
-            query_embedding,
-            db_embedding
-        )
-        results.append({
-            "index": idx,
-            "score": float(score)
-        })
 
-    # 3. ソート
-    results.sort(key=lambda x: x["score"], reverse=True)
+# ==========================================
+# シャード対応の検索
+# ==========================================
+# 戻り値は {"results": ..., "partial": bool}。シャードを使わない場合は常に partial=False
+def search_index(
+    query_embeddings: np.ndarray,
+    top_k: int = TOP_K,
+    filters: dict | None = None,
+    fusion: str | None = None,
+) -> dict:
+    """
+    1件のクエリ（fusion を指定した場合は1枚の画像の複数ビュー (V x 2048)）を検索する
+    """
+    index = active_index()
+    if fusion is None:
+        found = index.search(query_embeddings, top_k, filters)
+    else:
+        found = index.search_fused(query_embeddings, top_k, fusion, filters)
 
-    # 4. 上位結果の構築
-    ranked_results = []
-    for i, r in enumerate(results[:TOP_K], start=1):
-        idx = r["index"]
-        
-        # ファイル名の特定
-        image_name = image_ids[idx] if idx < len(image_ids) else "unknown.jpg"
-        
-        # products.json から該当商品を検索
-        # imageパスの末尾が image_name と一致するものを探す
-        product_info = next(
-            (p for p in products if p["image"].endswith(image_name)),
-            None
-        )
+    if SEARCH_SHARDED:
+        return found
+    return {"results": found, "partial": False}
 
-        # デフォルト値
-        brand = "Unknown"
-        model = "Unknown"
-        
-        if product_info:
-            brand = product_info.get("brand", "Unknown")
-            # series と model を結合して表示名にする
-            series = product_info.get("series", "")
-            model_name = product_info.get("model", "")
-            model = f"{series} {model_name}".strip()
 
-        ranked_results.append({
-            "rank": i,
-            "similarity": r["score"],  # Flutterに合わせて 'similarity' に変更
-            "brand": brand,
-            "model": model,
-            "image": image_name
-        })
+def search_index_batch(query_embeddings: np.ndarray, top_k: int = TOP_K, filters: dict | None = None) -> dict:
+    """
+    複数のクエリ (M x 2048) をまとめて検索する（results はクエリごとの結果リスト）
+    """
+    found = active_index().search_batch(query_embeddings, top_k, filters)
 
-    return ranked_results
\ No newline at end of file
+    if SEARCH_SHARDED:
+        return found
+    return {"results": found, "partial": False}
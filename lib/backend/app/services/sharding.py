@@ -0,0 +1,276 @@
+import os
+import glob
+import functools
+import heapq
+import itertools
+import threading
+import time
+import multiprocessing
+import numpy as np
+
+from lib.backend.app.config import (
+    SHARDS_DIR,
+    SHARD_TIMEOUT_MS,
+    SHARD_START_TIMEOUT,
+    SHARD_MAX_PENDING,
+)
+from lib.backend.app.services.vector_index import VectorIndex
+from lib.backend.app.services.metrics import timed
+
+# ==========================================
+# シャード分割したインデックス
+# ==========================================
+# 1プロセスのメモリに収まらないカタログ向けに、インデックスファイルを N 個の
+# シャードに分け、シャードごとに専用のワーカープロセスで検索する。
+# コーディネータはクエリを全シャードに同時に送り、各シャードの top-k
+# （類似度の降順）をマージして全体の top-k を作る。
+# 期限までに応答しなかったシャードは除き、結果に partial=True を付けて返す。
+
+SHARD_PATTERN = "shard-*.ccidx"
+
+
+def shard_paths(directory: str = SHARDS_DIR) -> list[str]:
+    return sorted(glob.glob(os.path.join(directory, SHARD_PATTERN)))
+
+
+def merge_results(per_shard: list[list[dict]], top_k_count: int) -> list[dict]:
+    """
+    シャードごとの検索結果（類似度の降順）をマージして上位 top_k_count 件を返す
+    """
+    merged = heapq.merge(*per_shard, key=lambda r: r["similarity"], reverse=True)
+
+    results = []
+    for rank, r in enumerate(itertools.islice(merged, top_k_count), start=1):
+        results.append({**r, "rank": rank})
+    return results
+
+
+# ==========================================
+# ワーカープロセス側
+# ==========================================
+_shard_index: VectorIndex | None = None
+
+
+def _init_worker(path: str):
+    global _shard_index
+    # 担当シャードだけを memmap で開く
+    _shard_index = VectorIndex.open(path)
+
+
+def _describe() -> tuple[int, int, str | None]:
+    return len(_shard_index), _shard_index.dim, _shard_index.model_id
+
+
+def _call(method: str, args: tuple):
+    return getattr(_shard_index, method)(*args)
+
+
+# ==========================================
+# コーディネータ
+# ==========================================
+class ShardedIndex:
+    """
+    シャードごとのワーカープロセスに検索を振り分けるインデックス
+
+    search / search_fused / search_batch は VectorIndex と同じ引数を取り、
+    {"results": ..., "partial": bool, "failed_shards": [シャード番号...]} を返す。
+
+    時間切れになった検索もワーカーでは最後まで実行されるため、シャードごとに
+    未完了の呼び出し数を数え、max_pending 以上なら送らずに失敗扱いにする。
+    """
+
+    def __init__(
+        self,
+        paths: list[str],
+        timeout_ms: float = SHARD_TIMEOUT_MS,
+        version: int = 1,
+        max_pending: int = SHARD_MAX_PENDING,
+    ):
+        if not paths:
+            raise FileNotFoundError(f"シャードが見つかりません: {SHARDS_DIR}")
+
+        self.paths = paths
+        self.timeout = timeout_ms / 1000.0
+        self.version = version
+        self.max_pending = max(1, max_pending)
+
+        # シャードごとに1プロセスのプール（プロセスが落ちても自動で作り直される）
+        context = multiprocessing.get_context("spawn")
+        self.pools = [
+            context.Pool(1, initializer=_init_worker, initargs=(path,))
+            for path in paths
+        ]
+
+        self.counts: list[int] = []
+        self.dims: list[int] = []
+        self._started = False
+        self._lock = threading.Lock()
+
+        # シャードごとの未完了の呼び出し数
+        self._pending = [0] * len(paths)
+        self._pending_lock = threading.Lock()
+
+    def start(self, timeout: float = SHARD_START_TIMEOUT):
+        """
+        全ワーカーがシャードを開き終えるまで待ち、件数・次元を確認する
+        """
+        with self._lock:
+            if self._started:
+                return
+
+            pending = [pool.apply_async(_describe) for pool in self.pools]
+            deadline = time.monotonic() + timeout
+            described = [r.get(max(0.0, deadline - time.monotonic())) for r in pending]
+
+            self.counts = [count for count, _, _ in described]
+            self.dims = [dim for _, dim, _ in described]
+            if len(set(self.dims)) != 1:
+                raise ValueError(f"シャードの次元が一致しません: {self.dims}")
+
+            model_ids = {model_id for _, _, model_id in described}
+            if len(model_ids) != 1:
+                print(f"[WARN] シャードのモデルが一致しません: {sorted(map(str, model_ids))}")
+
+            self._started = True
+
+    def __len__(self) -> int:
+        self.start()
+        return sum(self.counts)
+
+    @property
+    def size(self) -> int:
+        """
+        起動済みなら件数、起動前なら 0（ワーカーの起動を待たない）
+        """
+        return sum(self.counts) if self._started else 0
+
+    @property
+    def dim(self) -> int:
+        self.start()
+        return self.dims[0]
+
+    # -------------------------
+    def _scatter(self, method: str, args: tuple) -> tuple[list, list[int]]:
+        """
+        全シャードに同じ呼び出しを送り、期限までに返った結果と失敗したシャード番号を返す
+        """
+        self.start()
+
+        with timed("shards"):
+            pending = [self._submit(shard, method, args) for shard in range(len(self.pools))]
+            deadline = time.monotonic() + self.timeout
+
+            responses = []
+            failed = []
+            for shard, result in enumerate(pending):
+                if result is None:
+                    print(f"[WARN] シャード {shard} は未完了の検索が溜まっているため送りませんでした")
+                    failed.append(shard)
+                    continue
+                try:
+                    responses.append(result.get(max(0.0, deadline - time.monotonic())))
+                except multiprocessing.TimeoutError:
+                    print(f"[WARN] シャード {shard} が時間内に応答しませんでした")
+                    failed.append(shard)
+                except Exception as e:
+                    print(f"[WARN] シャード {shard} の検索に失敗しました: {type(e).__name__}: {e}")
+                    failed.append(shard)
+
+        return responses, failed
+
+    def _submit(self, shard: int, method: str, args: tuple):
+        """
+        シャードに呼び出しを送る。未完了が max_pending 以上なら送らずに None
+        """
+        with self._pending_lock:
+            if self._pending[shard] >= self.max_pending:
+                return None
+            self._pending[shard] += 1
+
+        done = functools.partial(self._done, shard)
+        try:
+            return self.pools[shard].apply_async(
+                _call, (method, args), callback=done, error_callback=done
+            )
+        except Exception:
+            done(None)
+            raise
+
+    def _done(self, shard: int, _result):
+        # 結果の受け取りスレッドから呼ばれる（時間切れで見捨てた呼び出しも含む）
+        with self._pending_lock:
+            self._pending[shard] -= 1
+
+    def _gather(self, method: str, args: tuple, top_k_count: int) -> dict:
+        responses, failed = self._scatter(method, args)
+        with timed("merge"):
+            results = merge_results(responses, top_k_count)
+        return {"results": results, "partial": bool(failed), "failed_shards": failed}
+
+    def search(self, query_embedding: np.ndarray, top_k_count: int, filters: dict | None = None) -> dict:
+        return self._gather("search", (query_embedding, top_k_count, filters), top_k_count)
+
+    def search_fused(
+        self,
+        view_embeddings: np.ndarray,
+        top_k_count: int,
+        fusion: str = "max",
+        filters: dict | None = None,
+    ) -> dict:
+        args = (view_embeddings, top_k_count, fusion, filters)
+        return self._gather("search_fused", args, top_k_count)
+
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        top_k_count: int,
+        filters: dict | None = None,
+    ) -> dict:
+        """
+        results はクエリごとの結果リスト
+        """
+        responses, failed = self._scatter("search_batch", (query_embeddings, top_k_count, filters))
+        with timed("merge"):
+            results = [
+                merge_results(list(per_query), top_k_count)
+                for per_query in zip(*responses)
+            ] if responses else [[] for _ in range(len(query_embeddings))]
+        return {"results": results, "partial": bool(failed), "failed_shards": failed}
+
+    def close(self):
+        for pool in self.pools:
+            pool.terminate()
+        for pool in self.pools:
+            pool.join()
+
+
+# ==========================================
+# プロセス共通のシャードインデックス
+# ==========================================
+_sharded: ShardedIndex | None = None
+_sharded_lock = threading.Lock()
+
+
+def get_sharded_index() -> ShardedIndex:
+    global _sharded
+    if _sharded is None:
+        with _sharded_lock:
+            if _sharded is None:
+                _sharded = ShardedIndex(shard_paths())
+    return _sharded
+
+
+def sharded_index_size() -> int:
+    """
+    /metrics 用の件数（ワーカーの作成・起動は行わない）
+    """
+    sharded = _sharded
+    return sharded.size if sharded is not None else 0
+
+
+def close_sharded_index():
+    global _sharded
+    with _sharded_lock:
+        if _sharded is not None:
+            _sharded.close()
+            _sharded = None
@@ -0,0 +1,117 @@
+import numpy as np
+
+# 保存形式として使える dtype
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+# float16 / int8 保存時に float32 へ戻しながら計算する行数
+BLOCK_ROWS = 4096
+
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(
+        np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    )
+
+
+def normalize_query(query: np.ndarray) -> np.ndarray:
+    """
+    クエリベクトル（1次元 or 2次元）を L2 正規化した float32 で返す
+    """
+    q = np.asarray(query, dtype=np.float32)
+    norms = np.linalg.norm(q, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return q / norms
+
+
+def to_storage(matrix: np.ndarray, dtype: str = "float32"):
+    """
+    正規化済み float32 行列を保存用 dtype に変換する
+
+    戻り値は (保存用行列, 行ごとのスケール or None)。
+    int8 は行ごとの対称量子化で、スコア計算時にスケールを掛け戻す。
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"未対応の dtype です: {dtype}")
+
+    if dtype == "float32":
+        return np.ascontiguousarray(matrix, dtype=np.float32), None
+
+    if dtype == "float16":
+        return np.ascontiguousarray(matrix, dtype=np.float16), None
+
+    max_abs = np.abs(matrix).max(axis=1)
+    scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+    quantized = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return np.ascontiguousarray(quantized), scales
+
+
+def score(matrix: np.ndarray, query: np.ndarray, scales: np.ndarray | None = None) -> np.ndarray:
+    """
+    保存済み行列と正規化済みクエリの内積（= コサイン類似度）を計算する
+
+    query が1次元なら (N,)、2次元 (M, D) なら (N, M) を返す。
+    float32 の場合は行列積1回で済ませる。
+    """
+    q = np.asarray(query, dtype=np.float32)
+
+    if matrix.dtype == np.float32:
+        scores = matrix @ q.T
+    else:
+        scores = np.empty((matrix.shape[0],) + q.shape[:-1], dtype=np.float32)
+        for start in range(0, matrix.shape[0], BLOCK_ROWS):
+            block = matrix[start:start + BLOCK_ROWS].astype(np.float32)
+            scores[start:start + BLOCK_ROWS] = block @ q.T
+
+    if scales is not None:
+        scores *= scales if scores.ndim == 1 else scales[:, None]
+
+    return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    スコア上位 k 件の (行番号, スコア) を降順で返す
+    """
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    if k < n:
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(n)
+
+    indices = indices[np.argsort(-scores[indices], kind="stable")]
+    return indices, scores[indices]
+
+
+def top_k_batch(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    score() の2次元結果 (N, M) から、クエリごとの上位 k 件を
+    (行番号 (M, k), スコア (M, k)) で返す
+    """
+    scores = np.ascontiguousarray(scores.T)
+    m, n = scores.shape
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((m, 0), dtype=np.int64), np.empty((m, 0), dtype=np.float32)
+
+    if k < n:
+        indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.broadcast_to(np.arange(n), (m, n))
+
+    top_scores = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def make_queries(matrix: np.ndarray, n: int, seed: int = 0) -> np.ndarray:
+    """
+    カタログのベクトルにノイズを加えて疑似クエリを作る（再現率レポート用）
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(matrix.shape[0], min(n, matrix.shape[0]), replace=False)
+    noise = rng.normal(scale=0.05, size=(len(rows), matrix.shape[1])).astype(np.float32)
+    return normalize_query(matrix[rows] + noise)
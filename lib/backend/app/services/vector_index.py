@@ -0,0 +1,546 @@
+import os
+import json
+import threading
+import time
+import numpy as np
+
+from lib.backend.app.config import (
+    PRODUCTS_JSON_PATH,
+    INDEX_WATCH_INTERVAL,
+    INDEX_STORAGE_DTYPE,
+    SEARCH_BACKEND,
+    IVF_INDEX_PATH,
+    IVF_NPROBE,
+    INDEX_FILE_PATH,
+    CATALOG_PATH,
+    COMPRESSED_PATH,
+    EMBEDDINGS_POINTER_PATH,
+    RERANK_EXPANSION,
+    RERANK_MIN_CANDIDATES,
+)
+from lib.backend.app.services.similarity import normalize_query, to_storage, score, top_k, top_k_batch
+from lib.backend.app.services.ann_index import IVFIndex
+from lib.backend.app.services.compression import RerankIndex
+from lib.backend.app.services.index_file import open_index_file
+from lib.backend.app.services.catalog import Catalog
+from lib.backend.app.services.embedding_store import resolve_paths
+from lib.backend.app.services.metrics import timed
+
+
+def _file_stamp(path: str) -> tuple:
+    """
+    ファイルの変更検知用スタンプ（inode, mtime, size）を返す
+    """
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _optional_stamp(path: str | None) -> tuple | None:
+    if path is None or not os.path.exists(path):
+        return None
+    return _file_stamp(path)
+
+
+def _load_stamps(embeddings_path, image_ids_path, products_path, catalog_path, ann_path) -> tuple:
+    # products.json はカタログがあれば無くてもよいので、どちらも任意扱いにする
+    return (
+        _file_stamp(embeddings_path),
+        _file_stamp(image_ids_path),
+        _optional_stamp(products_path),
+        _optional_stamp(catalog_path),
+        _optional_stamp(ann_path),
+    )
+
+
+def l2_normalize(embeddings: np.ndarray) -> np.ndarray:
+    """
+    行ごとに L2 正規化した float32 行列を返す（ゼロベクトルはそのまま）
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+
+    return np.ascontiguousarray(normalize_query(matrix))
+
+
+def _image_filename(image_path: str) -> str:
+    # products.json は Windows 区切り（data\raw\00001.jpg）の場合もある
+    return image_path.replace("\\", "/").rsplit("/", 1)[-1]
+
+
+def build_product_lookup(image_ids: list[str], products: list[dict]):
+    """
+    embedding の行番号 → 商品情報 の対応表を作る
+
+    戻り値は (行ごとの商品 or None, 商品が見つからない行, 重複した画像名)。
+    同じ画像名の商品が複数ある場合は先頭の商品を採用する。
+    """
+    by_filename = {}
+    collisions = []
+    for product in products:
+        filename = _image_filename(product.get("image", ""))
+        if filename in by_filename:
+            collisions.append(filename)
+            continue
+        by_filename[filename] = product
+
+    row_products = []
+    missing_rows = []
+    seen_ids = set()
+    for idx, image_id in enumerate(image_ids):
+        if image_id in seen_ids:
+            collisions.append(image_id)
+        seen_ids.add(image_id)
+
+        product = by_filename.get(image_id)
+        if product is None:
+            missing_rows.append(idx)
+        row_products.append(product)
+
+    return row_products, missing_rows, collisions
+
+
+class VectorIndex:
+    """
+    embeddings.npy / image_ids.json / 商品情報（catalog.npz or products.json）を
+    まとめて保持する読み取り専用のインデックス
+
+    生成後は変更しない。再読み込み時は新しいインスタンスを作って差し替える。
+    normalized=True の場合は embeddings を保存用行列（正規化・dtype 変換済み）
+    としてそのまま使う（インデックスファイルの memmap をコピーしないため）。
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        image_ids: list[str],
+        products: list[dict],
+        version: int = 0,
+        stamps: tuple = (),
+        storage_dtype: str = INDEX_STORAGE_DTYPE,
+        ann: IVFIndex | RerankIndex | None = None,
+        scales: np.ndarray | None = None,
+        normalized: bool = False,
+        row_products: list[dict | None] | None = None,
+        model_id: str | None = None,
+        catalog: Catalog | None = None,
+    ):
+        if len(embeddings) != len(image_ids):
+            raise ValueError(
+                f"embeddings と image_ids の件数が一致しません: "
+                f"{len(embeddings)} != {len(image_ids)}"
+            )
+
+        if normalized:
+            self.matrix, self.scales = embeddings, scales
+        else:
+            self.matrix, self.scales = to_storage(l2_normalize(embeddings), storage_dtype)
+        self.image_ids = image_ids
+        self.products = products
+        self.version = version
+        self.stamps = stamps
+        self.model_id = model_id
+
+        # 近似最近傍（IVF）または2段階検索のインデックス（件数が合わないものは使わない）
+        self.ann = ann
+        if ann is not None and len(ann) != len(image_ids):
+            print(
+                f"[WARN] {type(ann).__name__} の件数が一致しないため全件探索にします: "
+                f"{len(ann)} != {len(image_ids)}"
+            )
+            self.ann = None
+
+        # 行番号 → 商品 の対応表（検索時に products を走査しないため）
+        collisions = []
+        if catalog is None:
+            if row_products is None:
+                row_products, _, collisions = build_product_lookup(image_ids, products)
+            catalog = Catalog.from_row_products(image_ids, row_products)
+        self.catalog = catalog
+        missing_rows = catalog.missing_rows()
+
+        if len(missing_rows):
+            preview = ", ".join(image_ids[i] for i in missing_rows[:5])
+            print(f"[WARN] 商品情報のない画像が {len(missing_rows)} 件あります: {preview}")
+        if collisions:
+            preview = ", ".join(sorted(set(collisions))[:5])
+            print(f"[WARN] 画像名が重複しています（{len(collisions)} 件）: {preview}")
+
+    def __len__(self) -> int:
+        return len(self.image_ids)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def _filter_rows(self, filters: dict | None) -> np.ndarray | None:
+        """
+        絞り込み条件に一致する行番号（条件が無ければ None）
+        """
+        filters = {k: v for k, v in (filters or {}).items() if v is not None}
+        if not filters:
+            return None
+        with timed("filter"):
+            return self.catalog.filter_rows(filters)
+
+    def _search_rows(self, rows: np.ndarray, queries: np.ndarray, top_k_count: int):
+        """
+        rows の行だけをスコア計算する（件数に比例したコストで済む）
+        """
+        scales = self.scales[rows] if self.scales is not None else None
+        with timed("similarity"):
+            scores = score(self.matrix[rows], queries, scales)
+        with timed("top_k"):
+            if scores.ndim == 1:
+                indices, top_scores = top_k(scores, top_k_count)
+            else:
+                indices, top_scores = top_k_batch(scores, top_k_count)
+        return rows[indices], top_scores
+
+    def search(self, query_embedding: np.ndarray, top_k_count: int, filters: dict | None = None) -> list[dict]:
+        """
+        クエリに近い順に top_k_count 件の検索結果を返す
+
+        結果は {rank, similarity, brand, model, image} の形式。
+        filters（例: {"brand": "30865"}）を指定すると一致する商品だけを対象にする。
+        """
+        query = normalize_query(query_embedding)
+        rows = self._filter_rows(filters)
+
+        if rows is not None:
+            indices, top_scores = self._search_rows(rows, query, top_k_count)
+        elif self.ann is not None:
+            with timed("similarity"):
+                indices, top_scores = self.ann.search(
+                    self.matrix, query, top_k_count, scales=self.scales
+                )
+        else:
+            with timed("similarity"):
+                scores = score(self.matrix, query, self.scales)
+            with timed("top_k"):
+                indices, top_scores = top_k(scores, top_k_count)
+
+        with timed("assemble"):
+            return self.build_results(indices, top_scores)
+
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        top_k_count: int,
+        filters: dict | None = None,
+    ) -> list[list[dict]]:
+        """
+        複数のクエリ (M, D) をまとめて検索し、クエリごとの結果リストを返す
+
+        全件探索では行列積1回で全クエリのスコアを計算する。
+        filters は全クエリに共通で適用する。
+        """
+        queries = normalize_query(query_embeddings)
+        if queries.shape[0] == 0:
+            return []
+
+        rows = self._filter_rows(filters)
+
+        if rows is not None:
+            indices, top_scores = self._search_rows(rows, queries, top_k_count)
+        elif self.ann is not None:
+            # IVF / 2段階検索は候補がクエリごとに異なるので1件ずつ探索する
+            return [self.search(query, top_k_count) for query in queries]
+        else:
+            with timed("similarity"):
+                scores = score(self.matrix, queries, self.scales)
+            with timed("top_k"):
+                indices, top_scores = top_k_batch(scores, top_k_count)
+
+        with timed("assemble"):
+            return [
+                self.build_results(row_indices, row_scores)
+                for row_indices, row_scores in zip(indices, top_scores)
+            ]
+
+    def search_fused(
+        self,
+        view_embeddings: np.ndarray,
+        top_k_count: int,
+        fusion: str = "max",
+        filters: dict | None = None,
+    ) -> list[dict]:
+        """
+        1枚の画像の複数ビュー (V, D) で検索し、行ごとにスコアを統合（max / mean）して返す
+
+        全ビューのスコアは行列積1回で計算する。IVF / 2段階検索の場合は各ビューの候補を
+        合わせた行だけを正確に計算し直す。
+        """
+        queries = normalize_query(view_embeddings)
+        if queries.shape[0] == 1:
+            return self.search(queries[0], top_k_count, filters)
+
+        rows = self._filter_rows(filters)
+        if rows is None and self.ann is not None:
+            with timed("similarity"):
+                candidates = [
+                    self.ann.search(self.matrix, query, top_k_count, scales=self.scales)[0]
+                    for query in queries
+                ]
+            rows = np.unique(np.concatenate(candidates))
+
+        with timed("similarity"):
+            if rows is None:
+                scores = score(self.matrix, queries, self.scales)
+            else:
+                scales = self.scales[rows] if self.scales is not None else None
+                scores = score(self.matrix[rows], queries, scales)
+            fused = scores.max(axis=1) if fusion == "max" else scores.mean(axis=1)
+
+        with timed("top_k"):
+            indices, top_scores = top_k(fused, top_k_count)
+        if rows is not None:
+            indices = rows[indices]
+
+        with timed("assemble"):
+            return self.build_results(indices, top_scores)
+
+    def build_results(self, indices, scores) -> list[dict]:
+        ranked_results = []
+        for rank, (idx, similarity) in enumerate(zip(indices, scores), start=1):
+            brand, model = self.catalog.label(idx)
+
+            ranked_results.append({
+                "rank": rank,
+                "similarity": float(similarity),
+                "brand": brand,
+                "model": model,
+                "image": self.image_ids[idx]
+            })
+
+        return ranked_results
+
+    @classmethod
+    def load(
+        cls,
+        embeddings_path: str | None = None,
+        image_ids_path: str | None = None,
+        products_path: str = PRODUCTS_JSON_PATH,
+        version: int = 0,
+        ann_path: str | None = None,
+        catalog_path: str | None = None,
+        **kwargs,
+    ) -> "VectorIndex":
+        # パスを省略した場合は公開中の世代の embeddings.npy / image_ids.json を組で使う
+        if embeddings_path is None or image_ids_path is None:
+            embeddings_path, image_ids_path, _ = resolve_paths()
+
+        stamps = _load_stamps(embeddings_path, image_ids_path, products_path, catalog_path, ann_path)
+
+        embeddings = np.load(embeddings_path)
+
+        with open(image_ids_path, "r", encoding="utf-8") as f:
+            image_ids = json.load(f)
+
+        # 行順の揃ったカタログがあれば products.json は読まない
+        catalog = None
+        if catalog_path is not None and os.path.exists(catalog_path):
+            catalog = Catalog.load(catalog_path)
+            if not catalog.matches(image_ids):
+                print("[WARN] カタログの行順が image_ids と一致しないため products.json を使います")
+                catalog = None
+
+        products = []
+        if catalog is None:
+            with open(products_path, "r", encoding="utf-8") as f:
+                products = json.load(f)
+
+        ann = None
+        if stamps[-1] is not None:
+            ann = _load_ann(ann_path)
+
+        return cls(
+            embeddings, image_ids, products,
+            version=version, stamps=stamps, ann=ann, catalog=catalog, **kwargs,
+        )
+
+    @classmethod
+    def open(
+        cls,
+        index_path: str = INDEX_FILE_PATH,
+        version: int = 0,
+        ann_path: str | None = None,
+    ) -> "VectorIndex":
+        """
+        インデックスファイル（scripts/build_index_file.py で作成）を開く
+
+        ベクトル本体は memmap のまま使うので、同じホストのワーカー間で共有される。
+        """
+        # embedding の世代（CURRENT）が変わったことにも気付けるよう、スタンプに含める
+        stamps = (
+            _file_stamp(index_path),
+            _optional_stamp(EMBEDDINGS_POINTER_PATH),
+            _optional_stamp(ann_path),
+        )
+
+        matrix, scales, image_ids, row_products, header = open_index_file(index_path)
+        if not header["normalized"]:
+            raise ValueError(f"正規化されていないインデックスファイルです: {index_path}")
+
+        ann = None
+        if stamps[-1] is not None:
+            ann = _load_ann(ann_path)
+
+        return cls(
+            matrix, image_ids, [],
+            version=version, stamps=stamps, ann=ann,
+            scales=scales, normalized=True, row_products=row_products,
+            model_id=header["model_id"],
+        )
+
+
+# ==========================================
+# プロセス共通のインデックス
+# ==========================================
+_index: VectorIndex | None = None
+_lock = threading.Lock()
+_watcher: threading.Thread | None = None
+
+
+def _ann_path() -> str | None:
+    if SEARCH_BACKEND == "rerank":
+        return COMPRESSED_PATH
+    return IVF_INDEX_PATH if SEARCH_BACKEND == "ivf" else None
+
+
+def _load_ann(ann_path: str) -> IVFIndex | RerankIndex:
+    """
+    全件探索の代わりに使う検索（IVF or 圧縮 embedding + 再計算）を読み込む
+    """
+    if ann_path == COMPRESSED_PATH:
+        return RerankIndex.load(
+            ann_path,
+            expansion=RERANK_EXPANSION, min_candidates=RERANK_MIN_CANDIDATES,
+        )
+    return IVFIndex.load(ann_path, nprobe=IVF_NPROBE)
+
+
+def _use_index_file() -> bool:
+    return os.path.exists(INDEX_FILE_PATH)
+
+
+def _current_stamps() -> tuple:
+    if _use_index_file():
+        return (
+            _file_stamp(INDEX_FILE_PATH),
+            _optional_stamp(EMBEDDINGS_POINTER_PATH),
+            _optional_stamp(_ann_path()),
+        )
+
+    embeddings_path, image_ids_path, _ = resolve_paths()
+    return _load_stamps(
+        embeddings_path, image_ids_path, PRODUCTS_JSON_PATH, CATALOG_PATH, _ann_path()
+    )
+
+
+def _warn_if_index_file_stale():
+    # インデックスファイルは公開中の embedding の世代とは別に作られるため、
+    # 世代のほうが新しければ古いベクトルで検索していることになる
+    pointer = _optional_stamp(EMBEDDINGS_POINTER_PATH)
+    if pointer is not None and _file_stamp(INDEX_FILE_PATH)[1] < pointer[1]:
+        print(
+            f"[WARN] インデックスファイルが公開中の embedding より古いです: {INDEX_FILE_PATH}"
+            "（scripts/build_index_file.py で作り直してください）"
+        )
+
+
+def _load_configured(version: int) -> VectorIndex:
+    # インデックスファイルがあればそちらを優先する
+    if _use_index_file():
+        _warn_if_index_file_stale()
+        return VectorIndex.open(version=version, ann_path=_ann_path())
+    return VectorIndex.load(version=version, ann_path=_ann_path(), catalog_path=CATALOG_PATH)
+
+
+def get_index() -> VectorIndex:
+    """
+    プロセス共通のインデックスを返す（初回のみディスクから読み込む）
+
+    リクエスト処理中はファイルシステムに触れない。
+    ファイル更新の反映は reload_index() / start_watcher() が行う。
+    """
+    index = _index
+    if index is None:
+        with _lock:
+            if _index is None:
+                _swap(_load_configured(version=1))
+            index = _index
+    return index
+
+
+def _swap(new_index: VectorIndex):
+    global _index
+    _index = new_index
+
+
+def set_index(new_index: VectorIndex):
+    """
+    プロセス共通のインデックスを差し替える（ベンチマークなどで合成データを使う場合）
+    """
+    with _lock:
+        _swap(new_index)
+
+
+def reload_index(force: bool = False) -> bool:
+    """
+    ディスク上のファイルが変わっていれば読み込み直して差し替える
+
+    読み込みに失敗した場合は既存のインデックスを使い続ける。
+    戻り値は差し替えたかどうか。
+    """
+    with _lock:
+        current = _index
+
+        if current is not None and not force:
+            try:
+                if _current_stamps() == current.stamps:
+                    return False
+            except OSError as e:
+                print(f"[WARN] インデックスの状態確認に失敗しました: {e}")
+                return False
+
+        version = current.version + 1 if current is not None else 1
+
+        try:
+            new_index = _load_configured(version=version)
+        except Exception as e:
+            # 書きかけのファイル（BadZipFile / EOFError など）でも既存のインデックスを使い続ける
+            print(f"[WARN] インデックスの再読み込みに失敗しました: {type(e).__name__}: {e}")
+            return False
+
+        _swap(new_index)
+
+    print(f"[OK] インデックスを読み込みました（{len(new_index)} 件, version={version}）")
+    return True
+
+
+def _watch_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        # 例外でスレッドが止まると以後ファイル更新を反映できなくなるため、ここで止める
+        try:
+            reload_index()
+        except Exception as e:
+            print(f"[WARN] インデックスの監視中にエラーが発生しました: {type(e).__name__}: {e}")
+
+
+def start_watcher(interval: float = INDEX_WATCH_INTERVAL):
+    """
+    ファイル更新を監視するバックグラウンドスレッドを起動する
+    """
+    global _watcher
+    if interval <= 0 or _watcher is not None:
+        return
+
+    _watcher = threading.Thread(
+        target=_watch_loop,
+        args=(interval,),
+        name="vector-index-watcher",
+        daemon=True,
+    )
+    _watcher.start()
@@ -0,0 +1,319 @@
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+from PIL import Image
+
+from lib.backend.app.config import TOP_K
+from lib.backend.app.services.vector_index import VectorIndex, set_index
+
+# =========================
+# 設定
+# =========================
+EMBEDDING_DIM = 2048                   # ResNet50（fc 除去）の出力次元
+CATALOG_SIZES = (1_000, 10_000, 100_000)
+NUM_QUERIES = 200                      # 検索ベンチマークのクエリ数
+BATCH_SIZES = (1, 4, 8, 16, 32)        # create_embeddings のバッチサイズ
+NUM_IMAGES = 64                        # 推論・/predict に使う合成画像の枚数
+CONCURRENCY = (1, 4, 16)               # /predict の同時リクエスト数
+REQUESTS_PER_LEVEL = 64
+WARMUP = 3
+
+BRANDS = ("30865", "31522", "30120", "30511", "31007")
+SERIES = ("Qi35 MAX", "XXIO+(2026)", "PARADYM", "STEALTH", "G430")
+
+
+# =========================
+# 合成データ
+# =========================
+def make_catalog(n: int, dim: int = EMBEDDING_DIM, seed: int = 0):
+    """
+    ランダムな embedding と、それに対応する products.json 相当のデータを作る
+    """
+    rng = np.random.default_rng(seed)
+    # ResNet の特徴量（ReLU 後の平均プーリング）に似せて非負にする
+    embeddings = np.abs(rng.normal(size=(n, dim))).astype(np.float32)
+
+    image_ids = [f"{i:06d}.jpg" for i in range(1, n + 1)]
+    products = [
+        {
+            "id": i,
+            "brand": BRANDS[i % len(BRANDS)],
+            "series": SERIES[i % len(SERIES)],
+            "model": str(700000 + i),
+            "year": "",
+            "image": f"data\\raw\\{image_id}",
+        }
+        for i, image_id in enumerate(image_ids, start=1)
+    ]
+    return embeddings, image_ids, products
+
+
+def write_catalog(directory: str, embeddings: np.ndarray, image_ids: list, products: list):
+    paths = (
+        os.path.join(directory, "embeddings.npy"),
+        os.path.join(directory, "image_ids.json"),
+        os.path.join(directory, "products.json"),
+    )
+    np.save(paths[0], embeddings)
+    with open(paths[1], "w", encoding="utf-8") as f:
+        json.dump(image_ids, f)
+    with open(paths[2], "w", encoding="utf-8") as f:
+        json.dump(products, f, ensure_ascii=False)
+    return paths
+
+
+def make_images(n: int, size: int = 640, seed: int = 0) -> list[bytes]:
+    """
+    JPEG の合成画像（バイト列）を作る。画像ごとに内容を変えてキャッシュに当たらないようにする
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(n):
+        pixels = rng.integers(0, 256, size=(size // 8, size // 8, 3), dtype=np.uint8)
+        img = Image.fromarray(pixels).resize((size, size), Image.BILINEAR)
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=90)
+        images.append(buf.getvalue())
+    return images
+
+
+# =========================
+# 計測
+# =========================
+def summarize(samples: list[float]) -> dict:
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "n": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def measure(fn, inputs: list, warmup: int = WARMUP) -> dict:
+    for item in inputs[:warmup]:
+        fn(item)
+
+    samples = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_search(index: VectorIndex, num_queries: int) -> dict:
+    from lib.backend.app.services.search_service import search_similar
+
+    rng = np.random.default_rng(1)
+    rows = rng.choice(len(index), num_queries)
+    matrix = np.asarray(index.matrix[rows], dtype=np.float32)
+    queries = list(matrix + rng.normal(scale=0.05, size=matrix.shape).astype(np.float32))
+
+    return measure(search_similar, queries)
+
+
+def bench_image_search(images: list[bytes]) -> dict:
+    from lib.backend.app.services.image_search_service import ImageSearchService
+
+    service = ImageSearchService()
+    # キャッシュを無効にして毎回推論・検索させる
+    service.cache.max_entries = 0
+    return measure(lambda data: service.search(data, top_k=TOP_K), images)
+
+
+def bench_embedding(images: list[bytes], batch_sizes: tuple) -> dict:
+    from lib.backend.app.services.embedding_service import create_embeddings
+
+    create_embeddings(images[:1])   # モデルの読み込み
+
+    results = {}
+    for batch_size in batch_sizes:
+        batches = [
+            images[i:i + batch_size]
+            for i in range(0, len(images) - batch_size + 1, batch_size)
+        ]
+        if not batches:
+            continue
+        stats = measure(create_embeddings, batches, warmup=1)
+        stats["images_per_sec"] = batch_size / (stats["mean_ms"] / 1000.0)
+        results[str(batch_size)] = stats
+    return results
+
+
+async def _predict_level(client, images: list[bytes], concurrency: int, total: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            data = images[i % len(images)]
+            start = time.perf_counter()
+            response = await client.post(
+                "/predict", files={"file": (f"{i}.jpg", data, "image/jpeg")}
+            )
+            samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+
+    stats = summarize(samples)
+    stats["requests_per_sec"] = total / elapsed
+    stats["errors"] = errors
+    return stats
+
+
+async def _bench_predict(images: list[bytes], levels: tuple, total: int) -> dict:
+    import httpx
+    from lib.backend.app.api.main import app
+    from lib.backend.app.services.result_cache import result_cache
+
+    # 同じ画像を繰り返し送るので、キャッシュを無効にして推論・検索の時間を測る
+    result_cache.max_entries = 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await _predict_level(client, images, 1, WARMUP)
+
+        return {
+            str(concurrency): await _predict_level(client, images, concurrency, total)
+            for concurrency in levels
+        }
+
+
+def bench_predict(images: list[bytes], levels: tuple, total: int) -> dict:
+    return asyncio.run(_bench_predict(images, levels, total))
+
+
+def _optional(name: str, fn, *args) -> dict:
+    """
+    torch などが無い環境では該当のベンチマークだけ飛ばす
+    """
+    try:
+        return fn(*args)
+    except ImportError as e:
+        print(f"[SKIP] {name}: {e}")
+        return {"skipped": str(e)}
+
+
+def compare(report: dict, baseline: dict, key: str = "p50_ms", threshold: float = 0.1):
+    """
+    以前の結果 JSON と比べ、key が threshold 以上悪化した項目を表示する
+    """
+    def walk(current, previous, path):
+        if not isinstance(current, dict) or not isinstance(previous, dict):
+            return
+        if key in current and key in previous and previous[key] > 0:
+            change = current[key] / previous[key] - 1.0
+            mark = "[WARN]" if change >= threshold else "[OK]"
+            print(f"{mark} {path} {key}: {previous[key]:.3f} → {current[key]:.3f} ({change:+.1%})")
+            return
+        for name, value in current.items():
+            walk(value, previous.get(name), f"{path}/{name}" if path else name)
+
+    walk(report, baseline, "")
+
+
+# =========================
+# メイン処理
+# =========================
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    try:
+        import torch
+        torch_version = torch.__version__
+    except ImportError:
+        torch_version = None
+
+    return {
+        "commit": commit,
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch_version,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+    }
+
+
+def main(
+    sizes: tuple = CATALOG_SIZES,
+    num_queries: int = NUM_QUERIES,
+    skip_model: bool = False,
+    output: str | None = None,
+    baseline_path: str | None = None,
+):
+    report = {"environment": environment(), "search": {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            print(f"[INFO] 合成カタログ {n} 件")
+            paths = write_catalog(tmp, *make_catalog(n))
+
+            start = time.perf_counter()
+            index = VectorIndex.load(*paths)
+            load_ms = (time.perf_counter() - start) * 1000.0
+            set_index(index)
+
+            stats = bench_search(index, num_queries)
+            stats["load_ms"] = load_ms
+            report["search"][str(n)] = stats
+            print(f"   search_similar p50={stats['p50_ms']:.2f}ms p99={stats['p99_ms']:.2f}ms")
+
+        # 推論を含むベンチマークは最後に読み込んだカタログで行う
+        if not skip_model:
+            images = make_images(NUM_IMAGES)
+            report["catalog_size"] = sizes[-1]
+            report["embedding"] = _optional("create_embeddings", bench_embedding, images, BATCH_SIZES)
+            report["image_search"] = _optional("ImageSearchService.search", bench_image_search, images)
+            report["predict"] = _optional(
+                "/predict", bench_predict, images, CONCURRENCY, REQUESTS_PER_LEVEL
+            )
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"\n✅ ベンチマーク結果を保存しました：{output}")
+    else:
+        sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    # リポジトリ直下から python -m lib.backend.scripts.benchmark で実行する
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(CATALOG_SIZES),
+                        help="合成カタログの件数（複数指定可）")
+    parser.add_argument("--queries", type=int, default=NUM_QUERIES)
+    parser.add_argument("--skip-model", action="store_true",
+                        help="ResNet50 の推論を含むベンチマークを行わない")
+    parser.add_argument("--output", default=None, help="結果 JSON の保存先（省略時は標準出力）")
+    parser.add_argument("--compare", default=None, help="比較する以前の結果 JSON")
+    args = parser.parse_args()
+
+    main(tuple(args.sizes), args.queries, args.skip_model, args.output, args.compare)
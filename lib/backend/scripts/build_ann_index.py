@@ -0,0 +1,57 @@
+import argparse
+import numpy as np
+
+from lib.backend.app.config import IVF_INDEX_PATH, TOP_K
+from lib.backend.app.services.embedding_store import resolve_paths
+from lib.backend.app.services.ann_index import IVFIndex, recall_at_k
+from lib.backend.app.services.vector_index import l2_normalize
+from lib.backend.app.services.similarity import make_queries
+
+# =========================
+# 設定
+# =========================
+N_ITER = 20               # k-means の反復回数
+NUM_QUERIES = 200         # 再現率チェックに使うクエリ数
+NPROBES = (1, 2, 4, 8, 16, 32)
+
+
+def default_n_lists(n: int) -> int:
+    # 目安：リスト数 ≈ 4√N（1リストあたり √N/4 件程度）
+    return max(1, int(4 * np.sqrt(n)))
+
+
+def main(n_lists: int | None = None):
+    embeddings_path, _, _ = resolve_paths()
+    matrix = l2_normalize(np.load(embeddings_path))
+    n_lists = n_lists or default_n_lists(matrix.shape[0])
+
+    print(f"[INFO] {matrix.shape[0]} 件 / {n_lists} リストで IVF を作成します")
+    ann = IVFIndex.build(matrix, n_lists, n_iter=N_ITER)
+    ann.save(IVF_INDEX_PATH)
+
+    sizes = np.diff(ann.offsets)
+    print(f"[OK] {IVF_INDEX_PATH}")
+    print(f"   リストサイズ：平均 {sizes.mean():.1f} / 最大 {sizes.max()}")
+
+    # 全件探索との比較（recall@k とレイテンシ）
+    queries = make_queries(matrix, NUM_QUERIES)
+    print(f"\n🔍 recall@{TOP_K}（{len(queries)} クエリ）")
+    for nprobe in NPROBES:
+        if nprobe > ann.n_lists:
+            break
+        report = recall_at_k(matrix, ann, queries, k=TOP_K, nprobe=nprobe)
+        print(
+            f" nprobe={nprobe:>3}  recall={report['recall']:.3f}  "
+            f"ivf={report['ann_ms']:.2f}ms  exact={report['exact_ms']:.2f}ms"
+        )
+
+    print("\n✅ IVF インデックス作成完了（config.SEARCH_BACKEND = \"ivf\" で使用）")
+
+
+if __name__ == "__main__":
+    # リポジトリ直下から python -m lib.backend.scripts.build_ann_index で実行する
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lists", type=int, default=None, help="IVF のリスト数")
+    args = parser.parse_args()
+
+    main(args.lists)
@@ -0,0 +1,110 @@
+import os
+import json
+import argparse
+import numpy as np
+
+from lib.backend.app.config import (
+    PRODUCTS_JSON_PATH,
+    INDEX_FILE_PATH,
+    INDEX_STORAGE_DTYPE,
+    SHARDS_DIR,
+)
+from lib.backend.app.services.index_file import write_index_file, validate_index_file
+from lib.backend.app.services.similarity import STORAGE_DTYPES, to_storage
+from lib.backend.app.services.sharding import shard_paths
+from lib.backend.app.services.embedding_store import resolve_paths
+from lib.backend.app.services.vector_index import build_product_lookup, l2_normalize
+
+
+def read_model_id(path: str) -> str:
+    """
+    extract_embeddings.py が書き出すマニフェストからモデルのバージョンを読む
+    """
+    if not os.path.exists(path):
+        print(f"[WARN] マニフェストがないためモデル不明として記録します: {path}")
+        return "unknown"
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("model_version", "unknown")
+
+
+def write_checked(path: str, matrix, image_ids, row_products, scales, model_id: str, dtype: str):
+    write_index_file(
+        path,
+        matrix,
+        image_ids,
+        row_products,
+        scales=scales,
+        normalized=True,
+        model_id=model_id,
+    )
+
+    errors = validate_index_file(path)
+    for error in errors:
+        print(f"[WARN] {error}")
+
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"[OK] {path}（{len(image_ids)} 件, {dtype}, {size_mb:.1f} MB）")
+
+
+def write_shards(shards: int, matrix, image_ids, row_products, scales, model_id: str, dtype: str):
+    """
+    行を連続した shards 個の範囲に分け、SHARDS_DIR/shard-000.ccidx ... に書き出す
+    """
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+
+    # シャード数を減らした場合に古いシャードが残らないようにする
+    for path in shard_paths(SHARDS_DIR):
+        os.remove(path)
+
+    for shard, rows in enumerate(np.array_split(np.arange(len(image_ids)), shards)):
+        start, stop = (int(rows[0]), int(rows[-1]) + 1) if len(rows) else (0, 0)
+        write_checked(
+            os.path.join(SHARDS_DIR, f"shard-{shard:03d}.ccidx"),
+            matrix[start:stop],
+            image_ids[start:stop],
+            row_products[start:stop],
+            scales[start:stop] if scales is not None else None,
+            model_id,
+            dtype,
+        )
+
+
+def main(dtype: str = INDEX_STORAGE_DTYPE, output_path: str = INDEX_FILE_PATH, shards: int = 0):
+    # 公開中の世代の3ファイルを組で使う
+    embeddings_path, image_ids_path, manifest_path = resolve_paths()
+    embeddings = np.load(embeddings_path, mmap_mode="r")
+
+    with open(image_ids_path, "r", encoding="utf-8") as f:
+        image_ids = json.load(f)
+
+    with open(PRODUCTS_JSON_PATH, "r", encoding="utf-8") as f:
+        products = json.load(f)
+
+    row_products, missing_rows, collisions = build_product_lookup(image_ids, products)
+    if missing_rows:
+        print(f"[WARN] 商品情報のない画像が {len(missing_rows)} 件あります")
+    if collisions:
+        print(f"[WARN] 画像名が重複しています（{len(collisions)} 件）")
+
+    matrix, scales = to_storage(l2_normalize(embeddings), dtype)
+    model_id = read_model_id(manifest_path)
+
+    if shards > 0:
+        write_shards(shards, matrix, image_ids, row_products, scales, model_id, dtype)
+        print(f"\n✅ シャード {shards} 個のインデックスファイル作成完了：{SHARDS_DIR}")
+        return
+
+    write_checked(output_path, matrix, image_ids, row_products, scales, model_id, dtype)
+    print("\n✅ インデックスファイル作成完了")
+
+
+if __name__ == "__main__":
+    # リポジトリ直下から python -m lib.backend.scripts.build_index_file で実行する
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dtype", choices=STORAGE_DTYPES, default=INDEX_STORAGE_DTYPE)
+    parser.add_argument("--output", default=INDEX_FILE_PATH)
+    parser.add_argument("--shards", type=int, default=0,
+                        help="N 個のシャードに分けて SHARDS_DIR に書き出す（0 なら1ファイル）")
+    args = parser.parse_args()
+
+    main(args.dtype, args.output, args.shards)
@@ -3,6 +3,10 @@ import json
 import os
 from urllib.parse import urlparse
 
+from lib.backend.app.config import CATALOG_PATH
+from lib.backend.app.services.catalog import CatalogBuilder
+from lib.backend.app.services.embedding_store import resolve_paths
+
 # =========================
 # 設定
 # =========================
@@ -19,16 +23,11 @@ def get_extension(url: str) -> str:
     return ext if ext else ".jpg"
 
 
-# =========================
-# メイン処理
-# =========================
-def main():
-    if not os.path.exists(CSV_PATH):
-        raise FileNotFoundError(f"CSV が見つかりません: {CSV_PATH}")
-
-    products = []
-
-    with open(CSV_PATH, newline="", encoding="utf-8") as csvfile:
+def iter_products(csv_path: str = CSV_PATH):
+    """
+    CSV を1行ずつ読み、商品の dict を順に返す
+    """
+    with open(csv_path, newline="", encoding="utf-8") as csvfile:
         reader = csv.reader(csvfile)
 
         header = next(reader, None)
@@ -48,30 +47,80 @@ def main():
 
             ext = get_extension(product_url)
             image_filename = f"{index:05d}{ext}"
-            image_path = os.path.join("data", "raw", image_filename)
-
-            # 画像存在チェック
-            if not os.path.exists(os.path.join(BASE_DIR, image_path)):
-                print(f"[WARN] 画像が存在しません: {image_filename}")
 
-            product = {
+            yield {
                 "id": index,
                 "brand": row[0],
                 "series": row[1],
                 "model": row[2],
                 "year": row[3] if len(row) > 4 else None,
-                "image": image_path,
+                "image": os.path.join("data", "raw", image_filename),
                 "source_url": product_url
             }
 
-            products.append(product)
 
-    # JSON 出力
-    with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
-        json.dump(products, f, ensure_ascii=False, indent=2)
+def load_row_order(path: str | None = None) -> list[str] | None:
+    """
+    embedding の行順（公開中の世代の image_ids.json）。まだ作っていなければ None
+    """
+    if path is None:
+        _, path, _ = resolve_paths()
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# =========================
+# メイン処理
+# =========================
+def main():
+    if not os.path.exists(CSV_PATH):
+        raise FileNotFoundError(f"CSV が見つかりません: {CSV_PATH}")
+
+    # 画像の存在チェックはディレクトリを1回だけ読んで行う
+    existing = set(os.listdir(IMAGE_DIR)) if os.path.isdir(IMAGE_DIR) else set()
+
+    builder = CatalogBuilder()
+    csv_order = []
+    count = 0
+
+    # products.json は1件ずつ書き出し、全件をメモリに溜めない
+    tmp = f"{OUTPUT_JSON}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("[")
+        for product in iter_products():
+            image_filename = os.path.basename(product["image"])
+            if image_filename not in existing:
+                print(f"[WARN] 画像が存在しません: {image_filename}")
+
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(product, ensure_ascii=False))
+            count += 1
+
+            if builder.add(image_filename, product):
+                csv_order.append(image_filename)
+        f.write("\n]\n")
+    os.replace(tmp, OUTPUT_JSON)
+
+    print(f"✅ products.json を生成しました（{count} 件）")
+
+    # 列形式のカタログ（embedding の行順。image_ids.json が無ければ CSV の順）
+    row_order = load_row_order()
+    if row_order is None:
+        print("[INFO] image_ids.json が無いため CSV の順でカタログを作ります")
+        row_order = csv_order
+
+    catalog = builder.build(row_order)
+    os.makedirs(os.path.dirname(CATALOG_PATH), exist_ok=True)
+    catalog.save(CATALOG_PATH)
 
-    print(f"✅ products.json を生成しました（{len(products)} 件）")
+    missing = len(catalog.missing_rows())
+    if missing:
+        print(f"[WARN] 商品情報のない行が {missing} 件あります")
+    print(f"✅ カタログを生成しました（{len(catalog)} 行）：{CATALOG_PATH}")
 
 
 if __name__ == "__main__":
+    # リポジトリ直下から python -m lib.backend.scripts.build_products_json で実行する
     main()
@@ -1,16 +1,40 @@
-import json
-import numpy as np
-from app.config import EMBEDDINGS_JSON_PATH
+import sys
+import argparse
 
-with open(EMBEDDINGS_JSON_PATH, "r", encoding="utf-8") as f:
-    data = json.load(f)
+from lib.backend.app.config import INDEX_FILE_PATH
+from lib.backend.app.services.index_file import open_index_file, read_header, validate_index_file
 
-print("type(data):", type(data))
-print("len(data):", len(data))
 
-first = data[0]
-print("keys:", first.keys())
+def main(path: str = INDEX_FILE_PATH) -> int:
+    try:
+        header = read_header(path)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        return 1
 
-emb = np.array(first["embedding"])
-print("embedding shape:", emb.shape)
-print("embedding dtype:", emb.dtype)
+    print(f"📦 {path}")
+    for key in ("format_version", "count", "dim", "dtype", "normalized", "model_id"):
+        print(f"   {key}: {header.get(key)}")
+
+    errors = validate_index_file(path)
+    if errors:
+        for error in errors:
+            print(f"[ERROR] {error}")
+        return 1
+
+    _, _, image_ids, products, _ = open_index_file(path)
+    first = products[0] if products else None
+    if first is not None:
+        print(f"   先頭行: {image_ids[0]} → {first.get('brand')} {first.get('model')}")
+
+    print("\n✅ インデックスファイルに問題はありません")
+    return 0
+
+
+if __name__ == "__main__":
+    # リポジトリ直下から python -m lib.backend.scripts.check_embeddings で実行する
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default=INDEX_FILE_PATH)
+    args = parser.parse_args()
+
+    sys.exit(main(args.path))
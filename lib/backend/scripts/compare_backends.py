@@ -0,0 +1,62 @@
+import time
+import argparse
+import torch
+
+from lib.backend.app.services.embedder import build_model, build_transform
+from lib.backend.app.services.inference_backends import (
+    BACKENDS,
+    EagerBackend,
+    build_backend,
+    make_validation_batch,
+)
+
+# =========================
+# 設定
+# =========================
+BATCH_SIZES = (1, 8)
+REPEAT = 10
+
+
+def latency_ms(backend, batch: torch.Tensor, repeat: int = REPEAT) -> float:
+    """
+    1枚あたりの平均推論時間（ミリ秒）
+    """
+    backend(batch)   # ウォームアップ
+    start = time.perf_counter()
+    for _ in range(repeat):
+        backend(batch)
+    return (time.perf_counter() - start) / repeat / len(batch) * 1000.0
+
+
+def main(names: list[str]):
+    device = torch.device("cpu")
+    model = build_model(device)
+    batch = make_validation_batch(build_transform())
+
+    eager = EagerBackend(model, device)
+    baseline = {size: latency_ms(eager, batch[:size]) for size in BATCH_SIZES}
+
+    print(f"\n{'backend':<12} {'min cos':>8} " + " ".join(f"{f'bs={s}':>16}" for s in BATCH_SIZES))
+    for name in names:
+        backend, report = build_backend(name, model, device, batch)
+        if backend.name != name:
+            print(f"{name:<12} {'NG':>8}")
+            continue
+
+        min_cos = report["min_cosine"] if report else 1.0
+        cells = []
+        for size in BATCH_SIZES:
+            ms = latency_ms(backend, batch[:size])
+            cells.append(f"{ms:7.1f}ms (x{baseline[size] / ms:.1f})")
+        print(f"{name:<12} {min_cos:8.4f} " + " ".join(f"{c:>16}" for c in cells))
+
+    print("\n✅ 比較完了（config.INFERENCE_BACKEND で切り替え）")
+
+
+if __name__ == "__main__":
+    # リポジトリ直下から python -m lib.backend.scripts.compare_backends で実行する
+    parser = argparse.ArgumentParser()
+    parser.add_argument("backends", nargs="*", default=list(BACKENDS), choices=BACKENDS)
+    args = parser.parse_args()
+
+    main(args.backends)
@@ -0,0 +1,79 @@
+import argparse
+import numpy as np
+
+from lib.backend.app.config import (
+    COMPRESSED_PATH,
+    PCA_DIM,
+    PCA_WHITEN,
+    PQ_SUBSPACES,
+    RERANK_EXPANSION,
+    RERANK_MIN_CANDIDATES,
+    TOP_K,
+)
+from lib.backend.app.services.compression import (
+    CompressedStore,
+    RerankIndex,
+    accuracy_report,
+    rerank_recall,
+)
+from lib.backend.app.services.vector_index import l2_normalize
+from lib.backend.app.services.similarity import make_queries
+from lib.backend.app.services.embedding_store import resolve_paths
+
+# =========================
+# 設定
+# =========================
+NUM_QUERIES = 200   # 精度レポートに使うクエリ数
+EXPANSIONS = (1, 5, 10, 20, 30, 50)   # 2段階検索のレポートで試す候補数の倍率
+
+
+def main(dim: int = PCA_DIM, whiten: bool = PCA_WHITEN, pq_subspaces: int = PQ_SUBSPACES):
+    embeddings_path, _, _ = resolve_paths()
+    matrix = l2_normalize(np.load(embeddings_path))
+
+    # 学習データより多い次元は取れない
+    dim = min(dim, matrix.shape[0], matrix.shape[1])
+
+    print(f"[INFO] {matrix.shape[0]} 件 / {matrix.shape[1]} → {dim} 次元"
+          f"{'（白色化）' if whiten else ''}"
+          f"{f' + PQ {pq_subspaces} サブ空間' if pq_subspaces else ''}")
+
+    store = CompressedStore.build(matrix, dim, whiten=whiten, pq_subspaces=pq_subspaces)
+    store.save(COMPRESSED_PATH)
+
+    total_variance = float(matrix.var(axis=0).sum())
+    print(f"[OK] {COMPRESSED_PATH}")
+    print(f"   寄与率：{store.pca.explained_variance_ratio(total_variance):.3f}")
+
+    # 非圧縮の順位との比較
+    queries = make_queries(matrix, NUM_QUERIES)
+    report = accuracy_report(matrix, store, queries, k=TOP_K)
+    print(f"\n📊 精度レポート（{NUM_QUERIES} クエリ）")
+    print(f" recall@{report['k']}：{report['recall']:.3f}")
+    print(f" 1位一致率：{report['top1_agreement']:.3f}")
+    print(f" サイズ：{report['original_bytes_per_vector']} → {report['bytes_per_vector']} バイト/件")
+    print(f" 検索時間：{report['exact_ms']:.2f}ms → {report['compressed_ms']:.2f}ms")
+
+    # 2段階検索（圧縮で候補を絞り、候補だけ元の精度で再計算）の全件探索との比較
+    reranker = RerankIndex(store, expansion=RERANK_EXPANSION, min_candidates=RERANK_MIN_CANDIDATES)
+    print(f"\n🔍 2段階検索 recall@{TOP_K}（{len(queries)} クエリ, 最小候補数 {RERANK_MIN_CANDIDATES}）")
+    for expansion in EXPANSIONS:
+        report = rerank_recall(matrix, reranker, queries, k=TOP_K, expansion=expansion)
+        print(
+            f" expansion={expansion:>3}  候補={report['candidates']:>6}  "
+            f"recall={report['recall']:.3f}  "
+            f"rerank={report['rerank_ms']:.2f}ms  exact={report['exact_ms']:.2f}ms"
+        )
+
+    print("\n✅ 圧縮 embedding 作成完了（config.SEARCH_BACKEND = \"rerank\" で2段階検索に使用）")
+
+
+if __name__ == "__main__":
+    # リポジトリ直下から python -m lib.backend.scripts.compress_embeddings で実行する
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", type=int, default=PCA_DIM)
+    parser.add_argument("--whiten", action="store_true", default=PCA_WHITEN)
+    parser.add_argument("--pq", type=int, default=PQ_SUBSPACES, help="PQ のサブ空間数（0 で PQ なし）")
+    args = parser.parse_args()
+
+    main(args.dim, args.whiten, args.pq)
@@ -1,9 +1,15 @@
 import csv
+import json
 import os
+import random
+import threading
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse
 
+import requests
+from requests.adapters import HTTPAdapter
+
 # =========================
 # 設定
 # =========================
@@ -11,14 +17,20 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 CSV_PATH = os.path.join(BASE_DIR, "data", "products.csv")
 OUTPUT_DIR = os.path.join(BASE_DIR, "data", "raw")
+CHECKPOINT_PATH = os.path.join(OUTPUT_DIR, ".download_checkpoint.json")
 
 TIMEOUT = 10
-SLEEP_SEC = 0.2  # サーバ負荷軽減
+MAX_WORKERS = 8             # 同時ダウンロード数（全体）
+PER_HOST_CONCURRENCY = 4    # 同一ホストへの同時接続数
+RATE_PER_SEC = 5.0          # 全体のリクエスト数/秒（サーバ負荷軽減）
+MAX_RETRIES = 4             # 一時的なエラー時の再試行回数
+BACKOFF_BASE = 0.5          # 再試行の待ち時間（秒）の基数。0.5, 1, 2, 4... と伸ばす
+CHUNK_SIZE = 64 * 1024
 
-# =========================
-# 準備
-# =========================
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 既存ファイルも ETag / Last-Modified で更新確認する場合は True
+REVALIDATE = False
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
 
 def get_extension(url: str) -> str:
@@ -27,21 +39,241 @@ def get_extension(url: str) -> str:
     return ext if ext else ".jpg"
 
 
-def download_image(url: str, save_path: str):
-    response = requests.get(url, timeout=TIMEOUT)
-    response.raise_for_status()
-    with open(save_path, "wb") as f:
-        f.write(response.content)
+# =========================
+# 流量制御
+# =========================
+class TokenBucket:
+    """
+    rate 件/秒・最大 burst 件のトークンバケット（スレッドセーフ）
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class HostLimiter:
+    """
+    ホストごとの同時接続数を制限する
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphores: dict[str, threading.Semaphore] = {}
+        self.lock = threading.Lock()
+
+    def get(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.Semaphore(self.limit)
+            return self.semaphores[host]
+
+
+def make_session(pool_size: int = MAX_WORKERS) -> requests.Session:
+    """
+    接続を使い回すセッション（ホストごとに pool_size 本までプール）
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 # =========================
-# メイン処理
+# ダウンロード
 # =========================
-def main():
-    if not os.path.exists(CSV_PATH):
-        raise FileNotFoundError(f"CSV が見つかりません: {CSV_PATH}")
+def _retry_wait(attempt: int, response: requests.Response | None = None) -> float:
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+
+    # 指数バックオフ + ジッター
+    return BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random())
+
+
+def download_image(
+    session: requests.Session,
+    url: str,
+    save_path: str,
+    validators: dict | None = None,
+    bucket: TokenBucket | None = None,
+) -> tuple[str, dict]:
+    """
+    url を save_path に保存する
+
+    validators（前回の ETag / Last-Modified）があれば条件付きリクエストにする。
+    戻り値は ("ok" | "not_modified", 次回用の validators)。
+    """
+    headers = {}
+    if validators and os.path.exists(save_path):
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    part_path = f"{save_path}.part"
+
+    for attempt in range(MAX_RETRIES + 1):
+        if bucket is not None:
+            bucket.acquire()
+
+        response = None
+        try:
+            response = session.get(url, headers=headers, timeout=TIMEOUT, stream=True)
+
+            if response.status_code == 304:
+                return "not_modified", validators
+
+            if response.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+                time.sleep(_retry_wait(attempt, response))
+                continue
+
+            response.raise_for_status()
+
+            # 一時ファイルに少しずつ書き込み、完了後に置き換える
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+            os.replace(part_path, save_path)
 
-    with open(CSV_PATH, newline="", encoding="utf-8") as csvfile:
+            return "ok", {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= MAX_RETRIES:
+                raise
+            time.sleep(_retry_wait(attempt))
+
+        finally:
+            if response is not None:
+                response.close()
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    raise RuntimeError(f"再試行回数を超えました: {url}")
+
+
+def load_checkpoint(path: str = CHECKPOINT_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint: dict, path: str = CHECKPOINT_PATH):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def download_all(
+    jobs: list[tuple[str, str]],
+    output_dir: str = OUTPUT_DIR,
+    checkpoint_path: str = CHECKPOINT_PATH,
+    session: requests.Session | None = None,
+    max_workers: int = MAX_WORKERS,
+    per_host: int = PER_HOST_CONCURRENCY,
+    rate: float = RATE_PER_SEC,
+    revalidate: bool = REVALIDATE,
+) -> dict:
+    """
+    (url, ファイル名) のリストを並列にダウンロードする
+
+    途中で止まっても checkpoint と既存ファイルから再開できる。
+    戻り値は結果ごとの件数。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    session = session or make_session(max_workers)
+    bucket = TokenBucket(rate)
+    hosts = HostLimiter(per_host)
+    checkpoint = load_checkpoint(checkpoint_path)
+    checkpoint_lock = threading.Lock()
+    counts = {"ok": 0, "not_modified": 0, "skip": 0, "error": 0}
+
+    def run(url: str, filename: str) -> str:
+        save_path = os.path.join(output_dir, filename)
+        validators = checkpoint.get(filename)
+
+        if os.path.exists(save_path) and not (revalidate and validators):
+            return "skip"
+
+        with hosts.get(url):
+            status, new_validators = download_image(
+                session, url, save_path, validators, bucket
+            )
+
+        with checkpoint_lock:
+            checkpoint[filename] = new_validators
+        return status
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(run, url, filename): (url, filename) for url, filename in jobs}
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            url, filename = futures[future]
+            try:
+                status = future.result()
+                counts[status] += 1
+                if status == "skip":
+                    print(f"[SKIP] 既存ファイル: {filename}")
+                elif status == "not_modified":
+                    print(f"[SKIP] 更新なし: {filename}")
+                else:
+                    print(f"[OK] {filename}")
+            except Exception as e:
+                counts["error"] += 1
+                print(f"[ERROR] {filename}: {url}")
+                print(f"        {e}")
+
+            # 定期的にチェックポイントを保存して中断に備える
+            if done % 50 == 0:
+                with checkpoint_lock:
+                    save_checkpoint(checkpoint, checkpoint_path)
+
+    save_checkpoint(checkpoint, checkpoint_path)
+    return counts
+
+
+def read_jobs(csv_path: str = CSV_PATH) -> list[tuple[str, str]]:
+    """
+    CSV から (url, 保存ファイル名) のリストを作る
+    """
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"CSV が見つかりません: {csv_path}")
+
+    jobs = []
+    with open(csv_path, newline="", encoding="utf-8") as csvfile:
         reader = csv.reader(csvfile)
 
         header = next(reader, None)  # 1行目（タイトル行）
@@ -60,22 +292,20 @@ def main():
                 continue
 
             ext = get_extension(url)
-            filename = f"{index:05d}{ext}"
-            save_path = os.path.join(OUTPUT_DIR, filename)
+            jobs.append((url, f"{index:05d}{ext}"))
 
-            if os.path.exists(save_path):
-                print(f"[SKIP] 既存ファイル: {filename}")
-                continue
+    return jobs
 
-            try:
-                download_image(url, save_path)
-                print(f"[OK] {filename}")
-
-            except Exception as e:
-                print(f"[ERROR] 行 {index + 1}: {url}")
-                print(f"        {e}")
 
-            time.sleep(SLEEP_SEC)
+# =========================
+# メイン処理
+# =========================
+def main():
+    counts = download_all(read_jobs())
+    print(
+        f"\n成功 {counts['ok']} 件 / 未更新 {counts['not_modified']} 件 / "
+        f"既存 {counts['skip']} 件 / 失敗 {counts['error']} 件"
+    )
 
 
 if __name__ == "__main__":
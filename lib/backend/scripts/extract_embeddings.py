@@ -1,10 +1,30 @@
 import os
 import json
+import hashlib
+import argparse
 import numpy as np
-from PIL import Image
 
 import torch
-from torchvision import models, transforms
+from torch.utils.data import Dataset, DataLoader
+
+from lib.backend.app.services.embedder import (
+    EMBEDDING_DIM,
+    MODEL_VERSION,
+    Embedder,
+    build_transform,
+)
+from lib.backend.app.config import INDEX_FILE_PATH
+from lib.backend.app.services.image_io import IMAGE_SIZE, load_image
+from lib.backend.app.services.sharding import shard_paths
+from lib.backend.scripts import build_index_file
+from lib.backend.app.services.embedding_store import (
+    EMBEDDINGS_FILENAME,
+    IMAGE_IDS_FILENAME,
+    MANIFEST_FILENAME,
+    new_generation_dir,
+    publish,
+    resolve_paths,
+)
 
 # =========================
 # 設定
@@ -14,77 +34,260 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 IMAGE_DIR = os.path.join(BASE_DIR, "data", "processed")
 OUTPUT_DIR = os.path.join(BASE_DIR, "data", "embeddings")
 
-IMAGE_SIZE = 224
+# 出力は世代ごとのディレクトリ（OUTPUT_DIR/gen-*）に書き、CURRENT で公開する
+
 SUPPORTED_EXT = (".jpg", ".jpeg", ".png", ".webp")
 
+BATCH_SIZE = 32                            # 1回の推論でまとめる枚数
+NUM_WORKERS = min(8, os.cpu_count() or 1)  # 画像デコードの並列数
+
 # =========================
 # 準備
 # =========================
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# ResNet50（分類層を除去）と ImageNet 正規化は API と共通の Embedder を使う
+# カタログ側は INFERENCE_BACKEND に関係なく eager で作る（int8 / onnx の検証の基準になり、
+# manifest の MODEL_VERSION が同じなら --incremental で混ぜても同じ値になるように）
+embedder = Embedder(backend_name="eager")
 
-# ResNet50（分類層を除去）
-model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)
-model.fc = torch.nn.Identity()
-model = model.to(device)
-model.eval()
 
-# ImageNet 正規化
-transform = transforms.Compose([
-    transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
-    transforms.ToTensor(),
-    transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],
-        std=[0.229, 0.224, 0.225],
-    ),
-])
+class ImageFileDataset(Dataset):
+    """
+    画像ファイルを読み込んで前処理済みテンソルを返す Dataset
+    読み込みに失敗した画像は ok=False とゼロテンソルを返す
+    """
 
+    def __init__(self, image_paths: list[str]):
+        self.image_paths = image_paths
+        self.transform = build_transform()
 
-def extract_embedding(image_path: str) -> np.ndarray:
-    img = Image.open(image_path).convert("RGB")
-    tensor = transform(img).unsqueeze(0).to(device)
+    def __len__(self) -> int:
+        return len(self.image_paths)
 
-    with torch.no_grad():
-        embedding = model(tensor)
+    def __getitem__(self, idx: int):
+        image_path = self.image_paths[idx]
+        try:
+            tensor = self.transform(load_image(image_path))
+            return tensor, idx, True
+        except Exception as e:
+            print(f"[ERROR] {os.path.basename(image_path)}")
+            print(f"        {e}")
+            return torch.zeros((3, IMAGE_SIZE, IMAGE_SIZE)), idx, False
 
-    return embedding.cpu().numpy().flatten()
 
+def embed_files(
+    image_paths: list[str],
+    out: np.ndarray,
+    batch_size: int = BATCH_SIZE,
+    num_workers: int = NUM_WORKERS,
+    out_rows: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    image_paths を DataLoader で並列デコードしながらバッチ推論し、
+    結果を out（事前確保 or memmap の N x 2048 配列）に書き込む
 
-def main():
-    embeddings = []
-    image_ids = []
+    書き込み先の行は out_rows[i]（省略時は i）。
+    戻り値は image_paths のうち読み込みに成功したものを示す bool 配列。
+    """
+    ok = np.zeros(len(image_paths), dtype=bool)
+    if not image_paths:
+        return ok
 
-    files = sorted(os.listdir(IMAGE_DIR))
+    loader = DataLoader(
+        ImageFileDataset(image_paths),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        shuffle=False,
+    )
 
-    for filename in files:
-        if not filename.lower().endswith(SUPPORTED_EXT):
-            continue
+    done = 0
+    for tensors, indices, loaded in loader:
+        rows = indices.numpy()
+        dst_rows = rows if out_rows is None else out_rows[rows]
+        out[dst_rows] = embedder.embed_tensors(tensors)
+        ok[rows] = loaded.numpy()
 
-        image_path = os.path.join(IMAGE_DIR, filename)
+        done += len(rows)
+        print(f"[OK] {done} / {len(image_paths)}")
 
-        try:
-            emb = extract_embedding(image_path)
-            embeddings.append(emb)
-            image_ids.append(filename)
+    return ok
 
-            print(f"[OK] {filename}")
 
-        except Exception as e:
-            print(f"[ERROR] {filename}")
-            print(f"        {e}")
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_json(path: str, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load_manifest(manifest_path: str, embeddings_path: str, image_ids_path: str) -> dict | None:
+    """
+    前回実行時のマニフェスト（モデル版 + ファイルごとのハッシュ）を読む
+    モデル版が異なる・ファイルが揃っていない場合は None（全件作り直し）
+    """
+    if not all(os.path.exists(p) for p in (manifest_path, embeddings_path, image_ids_path)):
+        return None
+
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("model_version") != MODEL_VERSION:
+        print(f"[INFO] モデルが変わったため全件作り直します: {manifest.get('model_version')}")
+        return None
+
+    return manifest
+
 
-    embeddings = np.vstack(embeddings)
+def _compact(src: np.ndarray, keep: np.ndarray, dst_path: str, chunk_rows: int = 4096) -> int:
+    """
+    keep=True の行だけを dst_path（.npy）にチャンク単位でコピーする
+    """
+    rows = np.flatnonzero(keep)
+    dst = np.lib.format.open_memmap(
+        dst_path, mode="w+", dtype=np.float32, shape=(len(rows), src.shape[1])
+    )
+    _copy_rows(src, rows, dst, np.arange(len(rows)), chunk_rows)
+    dst.flush()
+    del dst
+    return len(rows)
 
-    # 保存
-    np.save(os.path.join(OUTPUT_DIR, "embeddings.npy"), embeddings)
 
-    with open(os.path.join(OUTPUT_DIR, "image_ids.json"), "w", encoding="utf-8") as f:
-        json.dump(image_ids, f, ensure_ascii=False, indent=2)
+def _copy_rows(src, src_rows, dst, dst_rows, chunk_rows: int = 4096):
+    for start in range(0, len(src_rows), chunk_rows):
+        end = start + chunk_rows
+        dst[dst_rows[start:end]] = src[src_rows[start:end]]
+
+
+def rebuild_index_files():
+    """
+    API が使うインデックスファイル・シャードがあれば、公開中の世代から作り直す
+    """
+    if os.path.exists(INDEX_FILE_PATH):
+        print("\n[INFO] インデックスファイルを作り直します")
+        build_index_file.main(output_path=INDEX_FILE_PATH)
+
+    # シャードは同じ数で作り直す（API 側への反映には再起動が必要）
+    shards = len(shard_paths())
+    if shards:
+        print(f"\n[INFO] シャード {shards} 個を作り直します（API の再起動で反映されます）")
+        build_index_file.main(shards=shards)
+
+
+def main(
+    batch_size: int = BATCH_SIZE,
+    num_workers: int = NUM_WORKERS,
+    incremental: bool = False,
+):
+    files = [
+        f for f in sorted(os.listdir(IMAGE_DIR))
+        if f.lower().endswith(SUPPORTED_EXT)
+    ]
+    image_paths = [os.path.join(IMAGE_DIR, f) for f in files]
+    hashes = [file_hash(p) for p in image_paths]
+
+    # 増分モード：前回と同じ内容のファイルは既存の embedding を使い回す
+    # （公開中の世代の3ファイルを組で読む）
+    old_embeddings_path, old_ids_path, old_manifest_path = resolve_paths()
+    manifest = None
+    if incremental:
+        manifest = load_manifest(old_manifest_path, old_embeddings_path, old_ids_path)
+    old_rows = {}
+    old_embeddings = None
+    if manifest is not None:
+        with open(old_ids_path, encoding="utf-8") as f:
+            old_ids = json.load(f)
+        old_hashes = manifest.get("files", {})
+        old_embeddings = np.load(old_embeddings_path, mmap_mode="r")
+        old_rows = {
+            image_id: row for row, image_id in enumerate(old_ids)
+            if image_id in old_hashes
+        }
+    else:
+        old_hashes = {}
+
+    reuse_src = []
+    reuse_dst = []
+    new_rows = []
+    for row, (filename, digest) in enumerate(zip(files, hashes)):
+        if filename in old_rows and old_hashes[filename] == digest:
+            reuse_src.append(old_rows[filename])
+            reuse_dst.append(row)
+        else:
+            new_rows.append(row)
+
+    removed = len(set(old_rows) - set(files))
+    print(f"[INFO] 再利用 {len(reuse_dst)} 件 / 新規・更新 {len(new_rows)} 件 / 削除 {removed} 件")
+
+    # 新しい世代のディレクトリに書く（公開するまで読み込み側からは見えない）
+    generation, generation_dir = new_generation_dir()
+    embeddings_path = os.path.join(generation_dir, EMBEDDINGS_FILENAME)
+    tmp_path = os.path.join(generation_dir, "embeddings.tmp.npy")
+
+    # 結果はリストに溜めずに memmap へ直接書き込む
+    embeddings = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=np.float32, shape=(len(files), EMBEDDING_DIM)
+    )
+
+    ok = np.zeros(len(files), dtype=bool)
+    if reuse_dst:
+        _copy_rows(old_embeddings, np.array(reuse_src), embeddings, np.array(reuse_dst))
+        ok[reuse_dst] = True
+    del old_embeddings
+
+    new_rows = np.array(new_rows, dtype=np.int64)
+    ok[new_rows] = embed_files(
+        [image_paths[r] for r in new_rows],
+        embeddings,
+        batch_size,
+        num_workers,
+        out_rows=new_rows,
+    )
+    embeddings.flush()
+
+    image_ids = [f for f, loaded in zip(files, ok) if loaded]
+
+    # 読み込めなかった画像があれば、その行を除いたファイルを作り直す
+    if not ok.all():
+        compact_path = os.path.join(generation_dir, "embeddings.compact.npy")
+        _compact(embeddings, ok, compact_path)
+        del embeddings
+        os.replace(compact_path, tmp_path)
+    else:
+        del embeddings
+
+    # 保存：3ファイルを世代ディレクトリに揃えてから CURRENT を1回で差し替える
+    # （読み込み側が世代の違うファイルを組み合わせることはない。API 側は監視スレッドが拾う）
+    os.replace(tmp_path, embeddings_path)
+    _write_json(os.path.join(generation_dir, IMAGE_IDS_FILENAME), image_ids)
+    _write_json(os.path.join(generation_dir, MANIFEST_FILENAME), {
+        "model_version": MODEL_VERSION,
+        "files": {
+            f: digest for f, digest, loaded in zip(files, hashes, ok) if loaded
+        },
+    })
+    publish(generation)
 
     print(f"\n✅ Embedding 抽出完了：{len(image_ids)} 件")
-    print(f"   次元数：{embeddings.shape[1]}")
+    print(f"   次元数：{EMBEDDING_DIM}")
+    print(f"   世代：{generation}")
 
+    # インデックスファイルがあると API はそちらを使うため、新しい世代から作り直す
+    rebuild_index_files()
 
 if __name__ == "__main__":
-    main()
+    # リポジトリ直下から python -m lib.backend.scripts.extract_embeddings で実行する
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--incremental", action="store_true",
+                        help="追加・変更された画像だけを embedding する")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    args = parser.parse_args()
+
+    main(args.batch_size, args.workers, incremental=args.incremental)
@@ -1,4 +1,6 @@
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageEnhance
 
 # =========================
@@ -15,14 +17,23 @@ CONTRAST = 1.2       # コントラスト補正
 
 SUPPORTED_EXT = (".jpg", ".jpeg", ".png", ".webp")
 
+NUM_WORKERS = os.cpu_count() or 1   # 並列プロセス数
+CHUNK_SIZE = 16                     # 1プロセスにまとめて渡す枚数
+
 # =========================
 # 準備
 # =========================
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# 0〜255 の階調（LUT を PIL 自身の補正処理で作るために使う）
+_GRADIENT = Image.frombytes("L", (256, 1), bytes(range(256)))
 
-def center_crop(img: Image.Image) -> Image.Image:
-    w, h = img.size
+# 明度補正は画像によらないので LUT を一度だけ作る
+_BRIGHTNESS_LUT = list(ImageEnhance.Brightness(_GRADIENT).enhance(BRIGHTNESS).getdata())
+
+
+def center_crop_box(size: tuple[int, int]) -> tuple[int, int, int, int]:
+    w, h = size
     side = min(w, h)
 
     left = (w - side) // 2
@@ -30,49 +41,102 @@ def center_crop(img: Image.Image) -> Image.Image:
     right = left + side
     bottom = top + side
 
-    return img.crop((left, top, right, bottom))
+    return (left, top, right, bottom)
 
 
-def preprocess_image(src_path: str, dst_path: str):
-    img = Image.open(src_path).convert("RGB")
+def center_crop(img: Image.Image) -> Image.Image:
+    return img.crop(center_crop_box(img.size))
+
+
+def enhance_lut(img: Image.Image) -> list[int]:
+    """
+    明度補正 → コントラスト補正 を1つの LUT（RGB 各256段階）にまとめる
+
+    コントラスト補正は「明度補正後のグレースケール平均」を基準にするため、
+    元画像のグレースケールヒストグラムに明度 LUT を通して平均を求める。
+    ImageEnhance を2回かける場合と丸め誤差程度の差しか出ない。
+    """
+    hist = img.convert("L").histogram()
+    total = sum(hist)
+    mean = sum(_BRIGHTNESS_LUT[v] * n for v, n in enumerate(hist)) / total
+    mean = int(mean + 0.5)
+
+    # ImageEnhance.Contrast と同じく、平均値一色の画像とのブレンドで LUT を作る
+    degenerate = Image.new("L", (256, 1), mean)
+    contrast_lut = list(Image.blend(degenerate, _GRADIENT, CONTRAST).getdata())
+
+    lut = [contrast_lut[b] for b in _BRIGHTNESS_LUT]
+    return lut * 3
 
-    # 中央トリミング
-    img = center_crop(img)
 
-    # リサイズ
-    img = img.resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR)
+def preprocess_image(src_path: str, dst_path: str):
+    img = Image.open(src_path)
+
+    # JPEG はデコード時に縮小しておく（中央トリミング後も IMAGE_SIZE 以上は残る）
+    img.draft("RGB", (IMAGE_SIZE, IMAGE_SIZE))
+    img = img.convert("RGB")
 
-    # 明度調整
-    img = ImageEnhance.Brightness(img).enhance(BRIGHTNESS)
+    # 中央トリミング + リサイズ（box 指定で中間画像を作らない）
+    img = img.resize(
+        (IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR, box=center_crop_box(img.size)
+    )
 
-    # コントラスト調整
-    img = ImageEnhance.Contrast(img).enhance(CONTRAST)
+    # 明度調整 + コントラスト調整（1回の LUT 変換）
+    img = img.point(enhance_lut(img))
 
     img.save(dst_path, quality=95)
 
 
-def main():
-    files = sorted(os.listdir(RAW_DIR))
+def _is_up_to_date(src_path: str, dst_path: str) -> bool:
+    return (
+        os.path.exists(dst_path)
+        and os.path.getmtime(dst_path) >= os.path.getmtime(src_path)
+    )
 
-    count = 0
-    for filename in files:
-        if not filename.lower().endswith(SUPPORTED_EXT):
-            continue
 
-        src_path = os.path.join(RAW_DIR, filename)
-        dst_path = os.path.join(OUTPUT_DIR, filename)
+def _process(task: tuple[str, str, str, bool]) -> tuple[str, str, str]:
+    filename, src_path, dst_path, force = task
+
+    if not force and _is_up_to_date(src_path, dst_path):
+        return filename, "skip", ""
 
-        try:
-            preprocess_image(src_path, dst_path)
-            count += 1
-            print(f"[OK] {filename}")
+    try:
+        preprocess_image(src_path, dst_path)
+        return filename, "ok", ""
+    except Exception as e:
+        return filename, "error", str(e)
 
-        except Exception as e:
-            print(f"[ERROR] {filename}")
-            print(f"        {e}")
 
-    print(f"\n✅ 前処理完了：{count} 枚")
+def main(num_workers: int = NUM_WORKERS, force: bool = False):
+    files = sorted(os.listdir(RAW_DIR))
+
+    tasks = [
+        (filename, os.path.join(RAW_DIR, filename), os.path.join(OUTPUT_DIR, filename), force)
+        for filename in files
+        if filename.lower().endswith(SUPPORTED_EXT)
+    ]
+
+    count = 0
+    skipped = 0
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        for filename, status, error in pool.map(_process, tasks, chunksize=CHUNK_SIZE):
+            if status == "ok":
+                count += 1
+                print(f"[OK] {filename}")
+            elif status == "skip":
+                skipped += 1
+            else:
+                print(f"[ERROR] {filename}")
+                print(f"        {error}")
+
+    print(f"\n✅ 前処理完了：{count} 枚（更新不要 {skipped} 枚）")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--force", action="store_true",
+                        help="出力が新しい場合も作り直す")
+    args = parser.parse_args()
+
+    main(args.workers, force=args.force)